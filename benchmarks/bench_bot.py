@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeBot, FakeFileServer, FakeLLMServer, FakeTavilyClient, photo_update, text_update, voice_update
+from src.my_agent import memory_index, metrics
+from src.my_agent.audio import AudioPipeline
+from src.my_agent.images import ImagePipeline
+from src.my_agent.llm_client import create_http_client, create_llm_client
+from src.my_agent.my_agent import (
+    BASE_CONTEXT, MODEL, PHOTO_MODEL, TRANSCRIPTION_MODEL,
+    create_echo_function, create_photo_function, create_tools, create_transcription_function, create_turn_function, generate_summary
+)
+from src.my_agent.rate_limiter import ModelLimits, RateLimitedLLMClient, RateLimiter
+from src.my_agent.session_registry import ChatContextRegistry
+from src.my_agent.turn_scheduler import TurnScheduler
+
+CHATS = 20
+MESSAGES_PER_CHAT = 50
+
+
+def percentile(timings, fraction: float) -> float:
+    return timings[max(0, int(len(timings) * fraction) - 1)]
+
+
+def database_size(db_path: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))
+
+
+def summarize_timings(timings) -> dict:
+    timings = sorted(timings)
+    if not timings:
+        return {"count": 0}
+    return {
+        "count": len(timings),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p99_ms": round(percentile(timings, 0.99), 2),
+        "max_ms": round(timings[-1], 2),
+    }
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp()
+    db_path = args.db_path or os.path.join(workdir, "bench_bot.db")
+    memory_dir = os.path.join(workdir, "memory") if args.memory and memory_index.is_available() else None
+    if args.metrics:
+        metrics.reset()
+        metrics.enable()
+
+    with FakeLLMServer(args.llm_latency, args.time_to_first_token, args.reply_words, args.tool_every, args.server_requests_per_minute) as llm, FakeFileServer(args.file_latency) as files:
+        limiter = RateLimiter(ModelLimits(args.requests_per_minute or None, args.tokens_per_minute or None))
+        groq_client = RateLimitedLLMClient(create_llm_client(api_key="fake", base_url=f"{llm.url}/openai/v1", max_retries=0), limiter)
+        download_client = create_http_client()
+        summarize = generate_summary(groq_client, MODEL)
+        summarize_calls = 0
+
+        async def counting_summarize(messages):
+            nonlocal summarize_calls
+            summarize_calls += 1
+            return await summarize(messages)
+
+        contexts = ChatContextRegistry(db_path, summarize_fn=counting_summarize, memory_dir=memory_dir)
+        initial_db_size = database_size(db_path)
+        tavily = FakeTavilyClient(args.tavily_latency)
+        tools = create_tools(tavily, storage=contexts.storage)
+        bot = FakeBot(files.url, args.telegram_latency)
+        context = SimpleNamespace(bot=bot)
+        turns = None
+        if args.turn_debounce is not None:
+            turns = TurnScheduler(create_turn_function(groq_client, MODEL, BASE_CONTEXT, contexts, tools, args.stream), debounce=args.turn_debounce)
+
+        handlers = {
+            "text": create_echo_function(groq_client, MODEL, BASE_CONTEXT, contexts, tools, args.stream, turns=turns),
+            "photo": create_photo_function(groq_client, PHOTO_MODEL, contexts, ImagePipeline(download_client), turns),
+            "voice": create_transcription_function(groq_client, TRANSCRIPTION_MODEL, contexts, tools, AudioPipeline(download_client), args.stream, turns=turns),
+        }
+        timings = {kind: [] for kind in handlers}
+
+        async def chat(chat_id: int):
+            # Updates within a chat are sequential, like a user waiting for
+            # each reply; chats run concurrently.
+            for turn in range(args.messages_per_chat):
+                if args.photo_every and turn % args.photo_every == args.photo_every - 1:
+                    kind, update = "photo", photo_update(chat_id, f"photo_{chat_id}_{turn}")
+                elif args.voice_every and turn % args.voice_every == args.voice_every - 1:
+                    kind, update = "voice", voice_update(chat_id, f"voice_{chat_id}_{turn}")
+                else:
+                    kind, update = "text", text_update(chat_id, f"Message {turn} from chat {chat_id}: tell me something about topic {turn % 7}.")
+                t0 = time.perf_counter()
+                await handlers[kind](update, context)
+                timings[kind].append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(chat(chat_id) for chat_id in range(args.chats)))
+        elapsed = time.perf_counter() - t0
+        # Let background summarization finish so its calls and rows count.
+        for chat_id in range(args.chats):
+            await contexts.get(str(chat_id)).wait_for_summaries()
+        contexts.storage.commit()
+        messages = contexts.storage.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        summaries = contexts.storage.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        final_db_size = database_size(db_path)
+
+        if turns is not None:
+            await turns.close()
+        await contexts.close()
+        await groq_client.close()
+        await download_client.aclose()
+
+    updates = sum(len(t) for t in timings.values())
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 2),
+        "latency": summarize_timings([t for kind in timings.values() for t in kind]),
+        "latency_by_kind": {kind: summarize_timings(t) for kind, t in timings.items()},
+        "messages": messages,
+        "summaries": summaries,
+        "summarize_calls": summarize_calls,
+        "summarize_calls_per_1k_messages": round(summarize_calls * 1000 / messages, 2) if messages else 0,
+        "db_bytes_initial": initial_db_size,
+        "db_bytes_final": final_db_size,
+        "db_bytes_per_message": round((final_db_size - initial_db_size) / messages, 1) if messages else 0,
+        "llm_requests": dict(llm.counts),
+        "tavily_calls": tavily.calls,
+        "telegram_sends": bot.sent,
+        "telegram_edits": bot.edits,
+        "metrics": metrics.snapshot() if args.metrics else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the bot's handlers against local fakes of Telegram, Groq and Tavily.")
+    parser.add_argument("--chats", type=int, default=CHATS, help="number of concurrent chats")
+    parser.add_argument("--messages-per-chat", type=int, default=MESSAGES_PER_CHAT)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per completion")
+    parser.add_argument("--time-to-first-token", type=float, default=0.05)
+    parser.add_argument("--reply-words", type=int, default=20)
+    parser.add_argument("--server-requests-per-minute", type=float, default=0, help="answer requests above this rate with 429 and Retry-After, 0 to disable")
+    parser.add_argument("--requests-per-minute", type=float, default=0, help="client-side request limit per model, 0 for none")
+    parser.add_argument("--tokens-per-minute", type=float, default=0, help="client-side token limit per model, 0 for none")
+    parser.add_argument("--tavily-latency", type=float, default=0.3)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--file-latency", type=float, default=0.01)
+    parser.add_argument("--tool-every", type=int, default=5, help="request a web search every Nth chat completion, 0 to disable")
+    parser.add_argument("--photo-every", type=int, default=10, help="send a photo every Nth update, 0 to disable")
+    parser.add_argument("--voice-every", type=int, default=7, help="send a voice note every Nth update, 0 to disable")
+    parser.add_argument("--stream", action="store_true", help="stream replies with progressive edits")
+    parser.add_argument("--turn-debounce", type=float, default=None, help="route chat turns through the turn scheduler with this debounce window")
+    parser.add_argument("--memory", action="store_true", help="enable the semantic memory index")
+    parser.add_argument("--metrics", action="store_true", help="collect per-stage metrics and include them in the result")
+    parser.add_argument("--db-path", default=None)
+    parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2), flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeLLMServer, FakeTelegramServer
+
+RUNS = 5
+POLL_TIMEOUT = 60.0
+SHUTDOWN_TIMEOUT = 30.0
+# Loaded on first use rather than at import; listed in the result when an
+# import of the entry point pulls them in anyway.
+LAZY_MODULES = ("tavily", "requests", "numpy", "PIL", "pydub")
+ENTRY_POINT = "src.my_agent.my_agent"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"import_s": elapsed, "loaded": [name for name in sys.argv[1:] if name in sys.modules]}}))
+"""
+
+
+def subprocess_env(**extra) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    env.update(extra)
+    return env
+
+
+def measure_interpreter() -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True, env=subprocess_env())
+    return time.perf_counter() - t0
+
+
+def measure_import(module: str) -> dict:
+    # A fresh interpreter per run, so nothing is already in sys.modules.
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(module=module), *LAZY_MODULES],
+        check=True, capture_output=True, text=True, env=subprocess_env()
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_first_poll(telegram: FakeTelegramServer, env: dict, workdir: str) -> dict:
+    # From spawning the bot to its first getUpdates call, then a Ctrl+C
+    # shutdown, as on a container restart.
+    telegram.reset()
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "a") as log:
+        t0 = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-m", ENTRY_POINT], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            if not telegram.polled.wait(POLL_TIMEOUT):
+                raise RuntimeError(f"The bot did not poll within {POLL_TIMEOUT}s, see {log_path}")
+            first_poll = telegram.first_poll_at - t0
+            t1 = time.perf_counter()
+            process.send_signal(signal.SIGINT)
+            process.wait(SHUTDOWN_TIMEOUT)
+            shutdown = time.perf_counter() - t1
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    return {"first_poll_s": first_poll, "shutdown_s": shutdown}
+
+
+def summarize(values) -> dict:
+    values = sorted(values)
+    return {
+        "median_ms": round(statistics.median(values) * 1000, 1),
+        "min_ms": round(values[0] * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def run(args) -> dict:
+    interpreter = [measure_interpreter() for _ in range(args.runs)]
+    imports = [measure_import(args.module) for _ in range(args.runs)]
+
+    workdir = tempfile.mkdtemp()
+    with FakeTelegramServer() as telegram, FakeLLMServer() as llm:
+        env = subprocess_env(
+            TELEGRAM_BOT_TOKEN="123456:fake",
+            TELEGRAM_BASE_URL=telegram.base_url,
+            GROQ_API_KEY="fake",
+            GROQ_BASE_URL=f"{llm.url}/openai/v1",
+            TAVILY_API_KEY="fake"
+        )
+        # The first start creates the database; later ones find it migrated.
+        starts = [measure_first_poll(telegram, env, workdir) for _ in range(args.runs)]
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "interpreter": summarize(interpreter),
+        "import": summarize([result["import_s"] for result in imports]),
+        "eagerly_loaded": imports[-1]["loaded"],
+        "first_poll": summarize([result["first_poll_s"] for result in starts]),
+        "first_poll_cold_db_ms": round(starts[0]["first_poll_s"] * 1000, 1),
+        "shutdown": summarize([result["shutdown_s"] for result in starts]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the bot's import time and time from process start to its first getUpdates poll.")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--module", default=ENTRY_POINT, help="module whose import time is measured")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2), flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
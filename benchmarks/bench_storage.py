@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from src.my_agent.archive import ARCHIVE_CHUNK_MESSAGES, HOT_MESSAGES, MessageArchive
+from src.my_agent.chat_context_manager import ChatContextManager
+from src.my_agent.storage import Storage
+
+SESSIONS = 100
+SAMPLES = 200
+
+
+def populate(storage: Storage, start: int, stop: int, sessions: int):
+    batch = []
+    for i in range(start, stop):
+        batch.append((f"chat_{i % sessions}", "user" if i % 2 else "assistant", f"message {i} " + "lorem ipsum " * 8))
+        if len(batch) == 10000:
+            storage.conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        storage.conn.executemany("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", batch)
+    # Roughly one level-0 summary per five messages, as the summarizer produces.
+    storage.conn.execute("""
+        INSERT INTO summaries (session_id, level, start_msg_id, end_msg_id, summary_text)
+        SELECT session_id, 0, id, id, 'summary' FROM messages WHERE id > ? AND id % 5 = 0
+    """, (start,))
+    storage.conn.commit()
+
+
+def database_size(db_path: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))
+
+
+def compact(storage: Storage, hot_messages: int, chunk_messages: int) -> dict:
+    # Checkpoints around the pass so the sizes are of the database file alone.
+    storage.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size_before = database_size(storage.db_path)
+    archive = MessageArchive(storage)
+    t0 = time.perf_counter()
+    moved = asyncio.run(archive.compact(hot_messages, chunk_messages))
+    reclaimed = asyncio.run(archive.vacuum())
+    elapsed = time.perf_counter() - t0
+    storage.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {
+        "archived_messages": moved,
+        "reclaimed_pages": reclaimed,
+        "compaction_s": round(elapsed, 3),
+        "hot_rows": storage.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+        "db_bytes_before": size_before,
+        "db_bytes_after": database_size(storage.db_path),
+    }
+
+
+def measure(ctx: ChatContextManager, samples: int) -> dict:
+    timings = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        ctx.get_context(system_prompt="You are a helpful bot.")
+        timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 4),
+        "p99_ms": round(timings[int(len(timings) * 0.99) - 1], 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure get_context latency as the database grows.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated total message counts")
+    parser.add_argument("--sessions", type=int, default=SESSIONS)
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--compact", action="store_true", help="move summarized history to the archive after each size and report the reclaimed space")
+    parser.add_argument("--hot-messages", type=int, default=HOT_MESSAGES)
+    parser.add_argument("--chunk-messages", type=int, default=ARCHIVE_CHUNK_MESSAGES)
+    parser.add_argument("--db-path", default=None)
+    args = parser.parse_args()
+
+    db_path = args.db_path or os.path.join(tempfile.mkdtemp(), "bench_storage.db")
+    storage = Storage(db_path)
+
+    results = []
+    rows = 0
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        populate(storage, rows, size, args.sessions)
+        rows = size
+        compaction = compact(storage, args.hot_messages, args.chunk_messages) if args.compact else {}
+        # A fresh manager per size: its cold start reads the recent window
+        # from SQLite, after which get_context is served from its cache.
+        t0 = time.perf_counter()
+        ctx = ChatContextManager(session_id="chat_0", storage=storage)
+        cold_start_ms = round((time.perf_counter() - t0) * 1000, 4)
+        result = {"rows": rows, "cold_start_ms": cold_start_ms, **measure(ctx, args.samples), **compaction}
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    storage.close()
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2048
+OGG_BYTES = b"OggS" + b"\x00" * 4096
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request, e.g. a cancelled generation.
+            pass
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    # Many connections are opened at once; with the default listen backlog
+    # of 5 the excess SYNs are dropped and only retried after a second.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeServer:
+    def __init__(self, handler_class):
+        self.server = _Server(("127.0.0.1", 0), handler_class)
+        self.server.owner = self
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _LLMHandler(_Handler):
+    def do_POST(self):
+        owner = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if self.path.endswith("/audio/transcriptions"):
+            owner.record("transcription")
+            time.sleep(owner.latency)
+            self._send_json({"text": "what is the weather like today"})
+            return
+
+        retry_after = owner.throttle()
+        if retry_after is not None:
+            owner.record("rate_limited")
+            error = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            self._send_json(error, status=429, headers={"retry-after": f"{retry_after:.3f}"})
+            return
+
+        body = json.loads(raw)
+        messages = body.get("messages", [])
+        kind = "summary" if messages and str(messages[0].get("content", "")).startswith("Create a concise summary") else "chat"
+        if any(isinstance(m.get("content"), list) for m in messages):
+            kind = "vision"
+        owner.record(kind)
+        # A tool call is requested on the first pass of every tool_every-th
+        # conversation turn, i.e. only when tools are offered.
+        wants_tool = bool(body.get("tools")) and owner.tool_every and owner.next_turn() % owner.tool_every == 0
+        if body.get("stream"):
+            self._stream(body, wants_tool)
+        else:
+            time.sleep(owner.latency)
+            self._send_json(owner.completion(body, wants_tool))
+
+    def _stream(self, body, wants_tool):
+        owner = self.server.owner
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data: str):
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            self.wfile.flush()
+
+        base = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "fake")}
+        time.sleep(owner.time_to_first_token)
+        if wants_tool:
+            delta = {"tool_calls": [{"index": 0, "id": "call_0", "type": "function", "function": {"name": "web_search", "arguments": json.dumps({"question": "weather today"})}}]}
+            send(json.dumps({**base, "choices": [{"index": 0, "delta": delta}]}))
+        else:
+            words = owner.reply_words
+            for i in range(words):
+                send(json.dumps({**base, "choices": [{"index": 0, "delta": {"content": f"word{i} "}}]}))
+                time.sleep(max(0.0, owner.latency - owner.time_to_first_token) / words)
+        send(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer(FakeServer):
+    def __init__(self, latency: float = 0.2, time_to_first_token: float = 0.05, reply_words: int = 20, tool_every: int = 0, requests_per_minute: float = 0, burst: float = None):
+        super().__init__(_LLMHandler)
+        # With requests_per_minute set, a token bucket holding a minute's
+        # worth of requests (or burst) answers the excess with 429 and
+        # Retry-After, like Groq's per-model limits (shared across models
+        # here). burst=0 rejects every request.
+        self.requests_per_minute = requests_per_minute
+        self.burst = requests_per_minute if burst is None else burst
+        self._allowance = self.burst
+        self._allowance_at = time.monotonic()
+        # (time, retry-after) of every 429 and the time of every accepted
+        # completion request.
+        self.rejections = []
+        self.accepted = []
+        self.latency = latency
+        self.time_to_first_token = time_to_first_token
+        self.reply_words = reply_words
+        self.tool_every = tool_every
+        self.counts = {}
+        self._turns = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind: str):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def throttle(self):
+        if not self.requests_per_minute:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            rate = self.requests_per_minute / 60
+            self._allowance = min(self.burst, self._allowance + (now - self._allowance_at) * rate)
+            self._allowance_at = now
+            if self._allowance < 1:
+                retry_after = (1 - self._allowance) / rate
+                self.rejections.append((now, retry_after))
+                return retry_after
+            self._allowance -= 1
+            self.accepted.append(now)
+            return None
+
+    def next_turn(self) -> int:
+        with self._lock:
+            self._turns += 1
+            return self._turns
+
+    def completion(self, body, wants_tool: bool):
+        if wants_tool:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{"id": "call_0", "type": "function", "function": {"name": "web_search", "arguments": json.dumps({"question": "weather today"})}}]
+            }
+        else:
+            message = {"role": "assistant", "content": " ".join(f"word{i}" for i in range(self.reply_words))}
+        return {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "tool_calls" if wants_tool else "stop", "message": message}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": self.reply_words, "total_tokens": self.reply_words}
+        }
+
+
+class _FileHandler(_Handler):
+    def do_GET(self):
+        owner = self.server.owner
+        time.sleep(owner.latency)
+        data = PNG_BYTES if self.path.endswith(".png") else OGG_BYTES
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeFileServer(FakeServer):
+    def __init__(self, latency: float = 0.01):
+        super().__init__(_FileHandler)
+        self.latency = latency
+
+
+class _TelegramHandler(_Handler):
+    def do_POST(self):
+        owner = self.server.owner
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method == "getUpdates":
+            owner.record_poll()
+            # A short long-poll with nothing to deliver.
+            time.sleep(owner.poll_delay)
+            result = []
+        else:
+            result = True
+        self._send_json({"ok": True, "result": result})
+
+
+class FakeTelegramServer(FakeServer):
+    # Bot API endpoint for TELEGRAM_BASE_URL: answers getMe and empty
+    # getUpdates, and records when the first poll arrives.
+    def __init__(self, poll_delay: float = 0.1):
+        super().__init__(_TelegramHandler)
+        self.poll_delay = poll_delay
+        self.polls = 0
+        self.first_poll_at = None
+        self.polled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    def record_poll(self):
+        with self._lock:
+            self.polls += 1
+            if self.first_poll_at is None:
+                self.first_poll_at = time.perf_counter()
+                self.polled.set()
+
+    def reset(self):
+        with self._lock:
+            self.polls = 0
+            self.first_poll_at = None
+            self.polled.clear()
+
+
+class FakeTavilyClient:
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+        self.calls = 0
+
+    async def search(self, question):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"query": question, "results": [{"title": "Fake result", "content": "Sunny, 21 degrees."}]}
+
+
+class FakeBot:
+    def __init__(self, file_server_url: str, latency: float = 0.02):
+        self.file_server_url = file_server_url
+        self.latency = latency
+        self.sent = 0
+        self.edits = 0
+        self._message_id = 0
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._delay()
+        self.sent += 1
+        self._message_id += 1
+        return SimpleNamespace(message_id=self._message_id, chat_id=chat_id, text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._delay()
+        self.edits += 1
+        return True
+
+    async def getFile(self, file_id):
+        await self._delay()
+        return SimpleNamespace(file_id=file_id, file_path=f"{self.file_server_url}/files/{file_id}")
+
+
+def text_update(chat_id: int, text: str):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        message=SimpleNamespace(text=text, caption=None, photo=None, voice=None)
+    )
+
+
+def photo_update(chat_id: int, file_unique_id: str):
+    photo = SimpleNamespace(file_id=f"{file_unique_id}.png", file_unique_id=file_unique_id)
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        message=SimpleNamespace(text=None, caption=None, photo=[photo], voice=None)
+    )
+
+
+def voice_update(chat_id: int, file_unique_id: str):
+    voice = SimpleNamespace(file_id=f"{file_unique_id}.oga", file_unique_id=file_unique_id, mime_type="audio/ogg")
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        message=SimpleNamespace(text=None, caption=None, photo=None, voice=voice)
+    )
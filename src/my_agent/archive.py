@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import zlib
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+from src.my_agent import metrics
+from src.my_agent.storage import Storage
+
+# Every session keeps at least this many newest messages in the hot table,
+# whether summarized or not.
+HOT_MESSAGES = 100
+ARCHIVE_CHUNK_MESSAGES = 200
+ARCHIVE_CACHE_CHUNKS = 8
+COMPACTION_INTERVAL = 3600.0
+# The first pass waits this long so it does not compete with startup.
+COMPACTION_START_DELAY = 60.0
+VACUUM_STEP_PAGES = 256
+COMPRESSION_LEVEL = 6
+
+MessageRow = Tuple[int, str, str, Optional[int]]
+# (index, workers) of a sharded worker process, see sharding.shard_for().
+Shard = Tuple[int, int]
+
+
+def encode_messages(rows: List[MessageRow]) -> bytes:
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decode_messages(data: bytes) -> List[MessageRow]:
+    return [tuple(row) for row in json.loads(zlib.decompress(data))]
+
+
+def owns_session(session_id: str, shard: Shard) -> bool:
+    # Sessions are keyed by chat id, which is what updates are sharded by;
+    # anything else belongs to the first worker.
+    index, workers = shard
+    try:
+        return int(session_id) % workers == index
+    except ValueError:
+        return index == 0
+
+
+class MessageArchive:
+    # Cold tier of the messages table: once a range is covered by a level-0
+    # summary and is older than the hot tail, its rows are moved here as
+    # zlib-compressed JSON chunks. Message ids are kept, so summaries and the
+    # memory index keep pointing at them.
+    def __init__(self, storage: Storage, cache_chunks: int = ARCHIVE_CACHE_CHUNKS):
+        self.storage = storage
+        self.cache_chunks = cache_chunks
+        self._chunks: "OrderedDict[int, List[MessageRow]]" = OrderedDict()
+
+    def _decode(self, chunk_id: int, data: bytes) -> List[MessageRow]:
+        # Chunks never change once written, so decoded ones can be reused.
+        rows = self._chunks.get(chunk_id)
+        if rows is not None:
+            self._chunks.move_to_end(chunk_id)
+            return rows
+        rows = decode_messages(data)
+        self._chunks[chunk_id] = rows
+        if len(self._chunks) > self.cache_chunks:
+            self._chunks.popitem(last=False)
+        return rows
+
+    def get(self, session_id: str, msg_id: int) -> Optional[MessageRow]:
+        row = self.storage.execute("""
+            SELECT id, start_msg_id, data FROM message_archive
+            WHERE session_id = ? AND end_msg_id >= ?
+            ORDER BY end_msg_id
+            LIMIT 1
+        """, (session_id, msg_id)).fetchone()
+        if row is None or row[1] > msg_id:
+            return None
+        for message in self._decode(row[0], row[2]):
+            if message[0] == msg_id:
+                return message
+        return None
+
+    def latest(self, session_id: str, before_id: int, limit: int) -> List[MessageRow]:
+        # The newest archived messages before before_id, oldest first.
+        rows: List[MessageRow] = []
+        cursor = self.storage.execute("""
+            SELECT id, data FROM message_archive
+            WHERE session_id = ? AND start_msg_id < ?
+            ORDER BY end_msg_id DESC
+        """, (session_id, before_id))
+        for chunk_id, data in cursor:
+            messages = [message for message in self._decode(chunk_id, data) if message[0] < before_id]
+            rows[:0] = messages[-(limit - len(rows)):]
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def iter_messages(self, session_id: str, after_id: int = 0) -> Iterator[MessageRow]:
+        # Every message of the session past after_id, archived ones first,
+        # e.g. for export or to rebuild the memory index.
+        cursor = self.storage.execute("""
+            SELECT data FROM message_archive
+            WHERE session_id = ? AND end_msg_id > ?
+            ORDER BY end_msg_id
+        """, (session_id, after_id))
+        for data, in cursor:
+            for message in decode_messages(data):
+                if message[0] > after_id:
+                    yield message
+        cursor = self.storage.execute("""
+            SELECT id, role, content, token_count FROM messages
+            WHERE session_id = ? AND id > ?
+            ORDER BY id
+        """, (session_id, after_id))
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            yield from rows
+
+    async def archive_chunk(self, session_id: str, hot_messages: int = HOT_MESSAGES, chunk_messages: int = ARCHIVE_CHUNK_MESSAGES) -> int:
+        # Moves the oldest chunk_messages eligible rows of the session in one
+        # transaction; returns how many were moved (0 once less than a full
+        # chunk is eligible). BEGIN IMMEDIATE makes a concurrent compaction
+        # in another process wait and then see the rows gone.
+        async with self.storage.transaction() as conn:
+            boundary = conn.execute("""
+                SELECT id FROM messages
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            """, (session_id, hot_messages - 1)).fetchone()
+            summarized = conn.execute("""
+                SELECT MAX(end_msg_id) FROM summaries
+                WHERE session_id = ? AND level = 0
+            """, (session_id,)).fetchone()[0]
+            if boundary is None or summarized is None:
+                return 0
+            rows = conn.execute("""
+                SELECT id, role, content, token_count FROM messages
+                WHERE session_id = ? AND id < ? AND id <= ?
+                ORDER BY id
+                LIMIT ?
+            """, (session_id, boundary[0], summarized, chunk_messages)).fetchall()
+            if len(rows) < chunk_messages:
+                return 0
+            start_id, end_id = rows[0][0], rows[-1][0]
+            conn.execute("""
+                INSERT INTO message_archive (session_id, start_msg_id, end_msg_id, message_count, data)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, start_id, end_id, len(rows), encode_messages(rows)))
+            conn.execute("""
+                DELETE FROM messages WHERE session_id = ? AND id >= ? AND id <= ?
+            """, (session_id, start_id, end_id))
+        return len(rows)
+
+    async def compact(self, hot_messages: int = HOT_MESSAGES, chunk_messages: int = ARCHIVE_CHUNK_MESSAGES, shard: Optional[Shard] = None) -> int:
+        # Only sessions with more rows than a hot tail plus a chunk can have
+        # anything to move. A sharded worker only compacts its own chats.
+        sessions = [session_id for session_id, in self.storage.execute("""
+            SELECT session_id FROM messages
+            GROUP BY session_id
+            HAVING COUNT(*) >= ?
+        """, (hot_messages + chunk_messages,)).fetchall() if shard is None or owns_session(session_id, shard)]
+        moved = 0
+        for session_id in sessions:
+            while True:
+                count = await self.archive_chunk(session_id, hot_messages, chunk_messages)
+                if not count:
+                    break
+                moved += count
+                metrics.inc("archived_messages_total", count)
+                # One chunk per transaction; let handlers run in between.
+                await asyncio.sleep(0)
+        return moved
+
+    async def vacuum(self, step_pages: int = VACUUM_STEP_PAGES) -> int:
+        # Returns free pages to the filesystem a step at a time, so the write
+        # lock is never held for long. Needs auto_vacuum = INCREMENTAL, see
+        # Storage.enable_incremental_vacuum().
+        conn = self.storage.conn
+        reclaimed = 0
+        while True:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            async with self.storage.transaction():
+                conn.execute(f"PRAGMA incremental_vacuum({min(free, step_pages)})").fetchall()
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= free:
+                break
+            reclaimed += free - left
+            await asyncio.sleep(0)
+        metrics.inc("vacuumed_pages_total", reclaimed)
+        return reclaimed
+
+
+class Compactor:
+    def __init__(
+        self,
+        archive: MessageArchive,
+        interval: float = COMPACTION_INTERVAL,
+        hot_messages: int = HOT_MESSAGES,
+        chunk_messages: int = ARCHIVE_CHUNK_MESSAGES,
+        start_delay: float = COMPACTION_START_DELAY,
+        shard: Optional[Shard] = None
+    ):
+        self.archive = archive
+        self.shard = shard
+        self.interval = interval
+        self.start_delay = start_delay
+        self.hot_messages = hot_messages
+        self.chunk_messages = chunk_messages
+        # One process rebuilds an existing database for incremental vacuum,
+        # on its first pass; until then vacuum() reclaims nothing.
+        self._rebuild_pending = shard is None or shard[0] == 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Tuple[int, int]:
+        with metrics.span("compaction"):
+            if self._rebuild_pending:
+                await self.archive.storage.enable_incremental_vacuum()
+                self._rebuild_pending = False
+            moved = await self.archive.compact(self.hot_messages, self.chunk_messages, self.shard)
+            reclaimed = await self.archive.vacuum()
+        if moved or reclaimed:
+            logging.info(f"Compactor: archived {moved} messages, reclaimed {reclaimed} pages")
+        return moved, reclaimed
+
+    async def _run(self):
+        await asyncio.sleep(self.start_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Compactor: compaction failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from src.my_agent import metrics
+
+# Formats the Groq/OpenAI transcription endpoint accepts as-is.
+ACCEPTED_AUDIO_FORMATS = {"flac", "mp3", "mp4", "mpeg", "mpga", "m4a", "ogg", "opus", "wav", "webm"}
+MIME_TYPE_FORMATS = {
+    "audio/ogg": "ogg",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/flac": "flac",
+    "audio/webm": "webm",
+}
+MAX_CONCURRENT_TRANSCODES = 4
+CHUNK_SIZE = 64 * 1024
+
+
+def detect_audio_format(location: str, mime_type: Optional[str] = None) -> Optional[str]:
+    if mime_type:
+        audio_format = MIME_TYPE_FORMATS.get(mime_type.split(";")[0].strip().lower())
+        if audio_format:
+            return audio_format
+    extension = os.path.splitext(urlparse(location).path)[1].lstrip(".").lower()
+    if extension == "oga":
+        return "ogg"
+    return extension or None
+
+
+class AudioPipeline:
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        max_concurrent_transcodes: int = MAX_CONCURRENT_TRANSCODES,
+        accepted_formats=ACCEPTED_AUDIO_FORMATS
+    ):
+        self.http_client = http_client
+        self.accepted_formats = set(accepted_formats)
+        self._transcodes = asyncio.Semaphore(max_concurrent_transcodes)
+
+    async def fetch_for_transcription(self, location: str, mime_type: Optional[str] = None) -> Tuple[str, bytes]:
+        audio_format = detect_audio_format(location, mime_type)
+        if audio_format in self.accepted_formats:
+            logging.debug(f"AudioPipeline: {audio_format} is accepted as-is, skipping transcoding")
+            return f"voice.{audio_format}", await self._download(location)
+        logging.debug(f"AudioPipeline: transcoding {audio_format} to mp3")
+        return "voice.mp3", await self.transcode(location)
+
+    async def _download(self, location: str) -> bytes:
+        with metrics.span("audio_download"):
+            response = await self.http_client.get(location)
+        response.raise_for_status()
+        return response.content
+
+    async def transcode(self, location: str) -> bytes:
+        async with self._transcodes, metrics.span("transcode"):
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel", "error",
+                "-i", "pipe:0",
+                "-acodec", "libmp3lame",
+                "-f", "mp3",
+                "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            # Read both output pipes while feeding stdin so ffmpeg never blocks
+            # on a full pipe buffer.
+            stdout = asyncio.ensure_future(process.stdout.read())
+            stderr = asyncio.ensure_future(process.stderr.read())
+            try:
+                await self._feed(location, process.stdin)
+                encoded = await stdout
+                errors = await stderr
+                returncode = await process.wait()
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                stdout.cancel()
+                stderr.cancel()
+                raise
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with code {returncode}: {errors.decode(errors='replace').strip()}")
+            return encoded
+
+    async def _feed(self, location: str, stdin: asyncio.StreamWriter):
+        try:
+            async with self.http_client.stream("GET", location) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    stdin.write(chunk)
+                    await stdin.drain()
+        finally:
+            stdin.close()
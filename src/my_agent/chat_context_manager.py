@@ -1,5 +1,23 @@
-import sqlite3
-from typing import Callable, List, Dict, Optional
+import asyncio
+import inspect
+import logging
+from collections import deque
+from itertools import islice
+from typing import Awaitable, Callable, Deque, List, Dict, Optional, Tuple, Union
+
+from src.my_agent import memory_index, metrics
+from src.my_agent.archive import MessageArchive
+from src.my_agent.memory_index import MemoryIndex
+from src.my_agent.storage import Storage
+from src.my_agent.summary_index import SummaryEntry, SummaryIndex
+from src.my_agent.summary_scheduler import SummaryScheduler
+from src.my_agent.tokens import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+SummarizeFn = Callable[[List[Dict[str, str]]], Union[str, Awaitable[str]]]
+
+# Rows embedded per step (a few ms) when the semantic memory catches up on a
+# backlog, between which handlers get to run.
+MEMORY_CATCH_UP_BATCH = 50
 
 
 class ChatContextManager:
@@ -8,10 +26,15 @@ class ChatContextManager:
         db_path: str = "chat_history.db",
         session_id: str = "default",
         max_history_messages: int = 20,
-        summarize_fn: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+        summarize_fn: Optional[SummarizeFn] = None,
         group_size_level_0: int = 5,
         group_size_higher_levels: int = 5,
-        max_summary_level: int = 3
+        max_summary_level: int = 3,
+        storage: Optional[Storage] = None,
+        max_context_tokens: int = 6000,
+        memory_dir: Optional[str] = None,
+        memory_top_k: int = memory_index.TOP_K,
+        archive: Optional[MessageArchive] = None
     ):
         self.db_path = db_path
         self.session_id = session_id
@@ -20,65 +43,187 @@ class ChatContextManager:
         self.group_size_level_0 = group_size_level_0
         self.group_size_higher_levels = group_size_higher_levels
         self.max_summary_level = max_summary_level
-        self.conn = sqlite3.connect(self.db_path)
-        self._init_schema()
+        self.max_context_tokens = max_context_tokens
+        self.memory_top_k = memory_top_k
+        # A shared storage (see ChatContextRegistry) is owned by the caller.
+        self._owns_storage = storage is None
+        self.storage = storage if storage is not None else Storage(self.db_path)
+        self.conn = self.storage.conn
+        # Summarized history moved out of the messages table by compaction.
+        self.archive = archive if archive is not None else MessageArchive(self.storage)
+        self._summary_scheduler = SummaryScheduler(self._update_summaries, name=session_id)
+        # Write-through cache of the newest max_history_messages + 1 rows (the
+        # extra row marks that older history exists) and of the summary cover
+        # preceding the window, so get_context never has to touch SQLite.
+        self._recent: Deque[Tuple[int, str, str, int]] = deque(maxlen=self.max_history_messages + 1)
+        # Rows pushed out of _recent that no summary covers yet (summaries lag
+        # behind the window), so context never skips from the last summary
+        # straight to the window.
+        self._unsummarized: Deque[Tuple[int, str, str, int]] = deque()
+        self._summary_index = SummaryIndex(self._load_summary_text)
+        # Optional long-term semantic memory over everything beyond the window.
+        self._memory: Optional[MemoryIndex] = None
+        self._memory_catch_up: Optional[asyncio.Task] = None
+        if memory_dir is not None:
+            if memory_index.is_available():
+                self._memory = MemoryIndex(memory_dir, session_id)
+            else:
+                logging.warning("ChatContextManager: numpy 2 is not installed, semantic memory is disabled")
+        self._load_cache()
 
-    def _init_schema(self):
+    def _load_cache(self):
         cursor = self.conn.cursor()
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                role TEXT,
-                content TEXT
-            )
-        """)
+            SELECT id, role, content, token_count FROM messages
+            WHERE session_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (self.session_id, self._recent.maxlen))
+        rows = cursor.fetchall()[::-1]
+        if len(rows) < self._recent.maxlen:
+            # Older rows may be archived if the window was enlarged past the
+            # hot tail that compaction keeps.
+            rows[:0] = self.archive.latest(self.session_id, rows[0][0] if rows else float("inf"), self._recent.maxlen - len(rows))
+        self._recent.extend(
+            (msg_id, role, content, token_count if token_count is not None else estimate_tokens(content))
+            for msg_id, role, content, token_count in rows
+        )
+
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS summaries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                level INTEGER,
-                start_msg_id INTEGER,
-                end_msg_id INTEGER,
-                summary_text TEXT
+            SELECT level, start_msg_id, end_msg_id, COALESCE(token_count, (LENGTH(summary_text) + 3) / 4)
+            FROM summaries
+            WHERE session_id = ?
+            ORDER BY level DESC, start_msg_id ASC
+        """, (self.session_id,))
+        # Highest levels first, so lower-level summaries they span are indexed
+        # without ever loading their text.
+        for level, start_msg_id, end_msg_id, token_count in cursor.fetchall():
+            self._summary_index.add(SummaryEntry(level, start_msg_id, end_msg_id, token_count))
+        for entry in self._summary_index.cover_until(float("inf")):
+            entry.summary_text = self._load_summary_text(entry)
+
+        if len(self._recent) == self._recent.maxlen:
+            cursor.execute("""
+                SELECT id, role, content, token_count FROM messages
+                WHERE session_id = ? AND id > ? AND id < ?
+                ORDER BY id
+            """, (self.session_id, self._summary_index.end_msg_id, self._recent[0][0]))
+            self._unsummarized.extend(
+                (msg_id, role, content, token_count if token_count is not None else estimate_tokens(content))
+                for msg_id, role, content, token_count in cursor.fetchall()
             )
-        """)
-        self.conn.commit()
 
-    def add_message(self, role: str, content: str):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO messages (session_id, role, content)
-            VALUES (?, ?, ?)
-        """, (self.session_id, role, content))
-        self.conn.commit()
-        self._update_summaries()
+        if self._memory is not None:
+            self._start_memory_catch_up()
 
-    def _get_last_messages(self, n: int) -> List[Dict[str, str]]:
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT role, content FROM messages
-            WHERE session_id = ?
-            ORDER BY id DESC
-            LIMIT ?
-        """, (self.session_id, n))
-        rows = cursor.fetchall()
-        return list(reversed([{"role": role, "content": content} for role, content in rows]))
+    def _start_memory_catch_up(self):
+        # Indexes whatever was written while the memory files were missing or
+        # behind, e.g. history from before the index existed. That can be the
+        # whole backlog of a session, so it runs as a background task.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self._catch_up_memory())
+            return
+        self._memory_catch_up = loop.create_task(self._catch_up_memory())
+
+    async def _catch_up_memory(self):
+        # Until a pass comes up short for both kinds, new rows are indexed
+        # here rather than by add_message/_insert_summary, so ids reach the
+        # index in order and last_id() never skips past a gap.
+        while True:
+            messages = list(islice(self.archive.iter_messages(self.session_id, self._memory.last_id(memory_index.MESSAGE)), MEMORY_CATCH_UP_BATCH))
+            summaries = self.conn.execute("""
+                SELECT id, summary_text FROM summaries
+                WHERE session_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (self.session_id, self._memory.last_id(memory_index.SUMMARY), MEMORY_CATCH_UP_BATCH)).fetchall()
+            self._memory.add_many(
+                [(memory_index.MESSAGE, msg_id, content) for msg_id, _, content, _ in messages]
+                + [(memory_index.SUMMARY, row_id, text) for row_id, text in summaries]
+            )
+            if len(messages) < MEMORY_CATCH_UP_BATCH and len(summaries) < MEMORY_CATCH_UP_BATCH:
+                break
+            await asyncio.sleep(0)
+        self._memory_catch_up = None
 
-    def _get_total_message_count(self) -> int:
+    def _load_summary_text(self, entry: SummaryEntry) -> str:
         cursor = self.conn.cursor()
         cursor.execute("""
-            SELECT COUNT(*) FROM messages WHERE session_id = ?
-        """, (self.session_id,))
-        return cursor.fetchone()[0]
+            SELECT summary_text FROM summaries
+            WHERE session_id = ? AND level = ? AND end_msg_id = ?
+        """, (self.session_id, entry.level, entry.end_msg_id))
+        row = cursor.fetchone()
+        return row[0] if row else ""
+
+    async def add_message(self, role: str, content: str):
+        # Counted once here and stored, so context assembly never re-tokenizes.
+        token_count = estimate_tokens(content)
+        with metrics.span("db_write"):
+            cursor = await self.storage.awrite("""
+                INSERT INTO messages (session_id, role, content, token_count)
+                VALUES (?, ?, ?, ?)
+            """, (self.session_id, role, content, token_count))
+        if len(self._recent) == self._recent.maxlen and self._recent[0][0] > self._summary_index.end_msg_id:
+            self._unsummarized.append(self._recent[0])
+        self._recent.append((cursor.lastrowid, role, content, token_count))
+        if self._memory is not None and self._memory_catch_up is None:
+            self._memory.add(memory_index.MESSAGE, cursor.lastrowid, content)
+        if self.summarize_fn is None:
+            raise ValueError("summarize_fn is not set")
+        self._summary_scheduler.notify()
+
+    async def wait_for_summaries(self):
+        await self._summary_scheduler.drain()
+
+    async def close(self):
+        await self._summary_scheduler.close()
+        if self._memory_catch_up is not None:
+            self._memory_catch_up.cancel()
+            await asyncio.gather(self._memory_catch_up, return_exceptions=True)
+            self._memory_catch_up = None
+        if self._memory is not None:
+            self._memory.close()
+        if self._owns_storage:
+            self.storage.close()
+
+    async def _summarize(self, messages: List[Dict[str, str]]) -> str:
+        with metrics.span("summarize"):
+            summary = self.summarize_fn(messages)
+            if inspect.isawaitable(summary):
+                summary = await summary
+        return summary
 
-    def _update_summaries(self):
+    async def _update_summaries(self) -> int:
         if self.summarize_fn is None:
             raise ValueError("summarize_fn is not set")
 
+        # Catch-up mode: keep building groups until no level has a complete
+        # one left, so a backlog of unsummarized messages is fully drained.
+        created = 0
+        while True:
+            made = int(await self._summarize_level_0())
+            for level in range(1, self.max_summary_level + 1):
+                made += int(await self._summarize_level(level))
+            if not made:
+                return created
+            created += made
+
+    async def _summarize_level_0(self) -> bool:
         cursor = self.conn.cursor()
-        total_message_count = self._get_total_message_count()
-        max_msg_id_to_summarize = total_message_count - self.max_history_messages
+        # Message ids are shared by all sessions in the table, so the window
+        # boundary is the id just before this session's recent history.
+        cursor.execute("""
+            SELECT id FROM messages
+            WHERE session_id = ?
+            ORDER BY id DESC
+            LIMIT 1 OFFSET ?
+        """, (self.session_id, self.max_history_messages))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        max_msg_id_to_summarize = row[0]
 
         # Level 0 — message summarize
         cursor.execute("""
@@ -95,76 +240,133 @@ class ChatContextManager:
         """, (self.session_id, last_end, self.group_size_level_0))
         group = cursor.fetchall()
 
-        if len(group) == self.group_size_level_0 and group[-1][0] <= max_msg_id_to_summarize:
-            msgs = [{"role": r, "content": c} for _, r, c in group]
-            summary = self.summarize_fn(msgs)
-            start_id = group[0][0]
-            end_id = group[-1][0]
-            cursor.execute("""
-                INSERT INTO summaries (session_id, level, start_msg_id, end_msg_id, summary_text)
-                VALUES (?, ?, ?, ?, ?)
-            """, (self.session_id, 0, start_id, end_id, summary))
-            self.conn.commit()
+        if len(group) < self.group_size_level_0 or group[-1][0] > max_msg_id_to_summarize:
+            return False
 
-        # upper levels — summaries summary
-        for level in range(1, self.max_summary_level + 1):
-            cursor.execute("""
-                SELECT MAX(end_msg_id) FROM summaries
-                WHERE session_id = ? AND level = ?
-            """, (self.session_id, level))
-            last_end = cursor.fetchone()[0] or 0
+        msgs = [{"role": r, "content": c} for _, r, c in group]
+        summary = await self._summarize(msgs)
+        await self._insert_summary(0, group[0][0], group[-1][0], summary)
+        return True
 
-            cursor.execute("""
-                SELECT id, start_msg_id, end_msg_id, summary_text
-                FROM summaries
-                WHERE session_id = ? AND level = ? AND end_msg_id > ?
-                ORDER BY start_msg_id ASC
-                LIMIT ?
-            """, (self.session_id, level - 1, last_end, self.group_size_higher_levels))
-            group = cursor.fetchall()
-
-            if len(group) == self.group_size_higher_levels:
-                texts = [{"role": "system", "content": row[3]} for row in group]
-                summary = self.summarize_fn(texts)
-                start_id = group[0][1]
-                end_id = group[-1][2]
-                cursor.execute("""
-                    INSERT INTO summaries (session_id, level, start_msg_id, end_msg_id, summary_text)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (self.session_id, level, start_id, end_id, summary))
-                self.conn.commit()
-
-    def get_summary_until(self, msg_id: int) -> Optional[str]:
+    async def _summarize_level(self, level: int) -> bool:
+        # upper levels — summaries summary
         cursor = self.conn.cursor()
         cursor.execute("""
-            SELECT summary_text FROM summaries
-            WHERE session_id = ? AND end_msg_id <= ?
-            ORDER BY level DESC, end_msg_id DESC
-            LIMIT 1
-        """, (self.session_id, msg_id))
-        row = cursor.fetchone()
-        return row[0] if row else None
+            SELECT MAX(end_msg_id) FROM summaries
+            WHERE session_id = ? AND level = ?
+        """, (self.session_id, level))
+        last_end = cursor.fetchone()[0] or 0
 
-    def get_context(self, system_prompt: str = None) -> List[Dict[str, str]]:
-        total_messages = self._get_total_message_count()
+        cursor.execute("""
+            SELECT id, start_msg_id, end_msg_id, summary_text
+            FROM summaries
+            WHERE session_id = ? AND level = ? AND end_msg_id > ?
+            ORDER BY start_msg_id ASC
+            LIMIT ?
+        """, (self.session_id, level - 1, last_end, self.group_size_higher_levels))
+        group = cursor.fetchall()
+
+        if len(group) < self.group_size_higher_levels:
+            return False
 
+        texts = [{"role": "system", "content": row[3]} for row in group]
+        summary = await self._summarize(texts)
+        await self._insert_summary(level, group[0][1], group[-1][2], summary)
+        return True
+
+    async def _insert_summary(self, level: int, start_id: int, end_id: int, summary: str):
+        token_count = estimate_tokens(summary)
+        cursor = await self.storage.awrite("""
+            INSERT OR IGNORE INTO summaries (session_id, level, start_msg_id, end_msg_id, summary_text, token_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (self.session_id, level, start_id, end_id, summary, token_count))
+        if cursor.rowcount == 0:
+            # Another process already summarized this range; adopt its row.
+            logging.warning(f"ChatContextManager: summary of level {level} from {start_id} already exists for session {self.session_id}")
+            end_id, summary, token_count = self.conn.execute("""
+                SELECT end_msg_id, summary_text, COALESCE(token_count, 0) FROM summaries
+                WHERE session_id = ? AND level = ? AND start_msg_id = ?
+            """, (self.session_id, level, start_id)).fetchone()
+            self._summary_index.add(SummaryEntry(level, start_id, end_id, token_count, summary))
+            self._drop_summarized()
+            return
+        self._summary_index.add(SummaryEntry(level, start_id, end_id, token_count, summary))
+        self._drop_summarized()
+        if self._memory is not None and self._memory_catch_up is None:
+            self._memory.add(memory_index.SUMMARY, cursor.lastrowid, summary)
+
+    def _drop_summarized(self):
+        while self._unsummarized and self._unsummarized[0][0] <= self._summary_index.end_msg_id:
+            self._unsummarized.popleft()
+
+    def get_context(self, system_prompt: str = None) -> List[Dict[str, str]]:
         context = []
+        budget = self.max_context_tokens
         if system_prompt:
             context.append({"role": "system", "content": system_prompt})
+            budget -= estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
 
-        if total_messages > self.max_history_messages:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT id FROM messages
-                WHERE session_id = ?
-                ORDER BY id DESC
-                LIMIT ?
-            """, (self.session_id, self.max_history_messages))
-            last_ids = [row[0] for row in cursor.fetchall()]
-            first_to_exclude = min(last_ids)
-            summary = self.get_summary_until(first_to_exclude - 1)
-            if summary:
-                context.append({"role": "system", "content": summary})
-
-        context.extend(self._get_last_messages(self.max_history_messages))
+        rows = list(self._recent)
+        has_older = len(rows) > self.max_history_messages
+        if has_older:
+            # Older messages no summary covers yet are raw history too.
+            summarized = self._summary_index.end_msg_id
+            rows = list(self._unsummarized) + [row for row in rows[:1] if row[0] > summarized] + rows[1:]
+
+        # Newest messages first until the budget runs out; the latest message
+        # is always kept so the model sees what it is answering.
+        recent = []
+        for row in reversed(rows):
+            cost = row[3] + MESSAGE_OVERHEAD_TOKENS
+            if recent and cost > budget:
+                has_older = True
+                break
+            recent.append(row)
+            budget -= cost
+        recent.reverse()
+
+        if has_older and recent:
+            # Spend what is left on the summary cover, newest ranges first;
+            # when it does not all fit, the oldest ranges are dropped.
+            budget -= MESSAGE_OVERHEAD_TOKENS
+            summaries = []
+            for entry in reversed(self._summary_index.cover_until(recent[0][0] - 1)):
+                if entry.token_count > budget:
+                    break
+                summaries.append(entry.summary_text)
+                budget -= entry.token_count
+            if summaries:
+                context.append({"role": "system", "content": "\n\n".join(reversed(summaries))})
+
+            if self._memory is not None:
+                with metrics.span("memory_recall"):
+                    recalled = self._recall(recent[-1][2], recent[0][0], budget - MESSAGE_OVERHEAD_TOKENS, set(summaries))
+                if recalled:
+                    context.append({"role": "system", "content": "Relevant earlier conversation:\n" + "\n".join(recalled)})
+
+        context.extend({"role": role, "content": content} for _, role, content, _ in recent)
         return context
+
+    def _recall(self, query: str, first_recent_id: int, budget: int, included: set) -> List[str]:
+        snippets = []
+        for kind, row_id, score in self._memory.search(query, k=self.memory_top_k, before_message_id=first_recent_id):
+            if kind == memory_index.MESSAGE:
+                row = self.conn.execute("SELECT role, content, token_count FROM messages WHERE id = ?", (row_id,)).fetchone()
+                if row is None:
+                    archived = self.archive.get(self.session_id, row_id)
+                    if archived is None:
+                        continue
+                    row = archived[1:]
+                text, token_count = f"{row[0]}: {row[1]}", row[2]
+            else:
+                row = self.conn.execute("SELECT summary_text, token_count FROM summaries WHERE id = ?", (row_id,)).fetchone()
+                if row is None or row[0] in included:
+                    continue
+                text, token_count = f"summary: {row[0]}", row[1]
+            token_count = (token_count if token_count is not None else estimate_tokens(text)) + 2
+            if token_count > budget:
+                continue
+            logging.debug(f"ChatContextManager: recalled {kind}:{row_id} with score {score:.2f}")
+            snippets.append(text)
+            budget -= token_count
+        return snippets
@@ -0,0 +1,83 @@
+import base64
+import logging
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import httpx
+
+from src.my_agent import metrics
+
+SNIFF_BYTES = 16
+CHUNK_SIZE = 64 * 1024
+# Groq rejects base64 images above 4 MB (base64 adds a third to the raw
+# size); larger ones are passed by URL instead.
+MAX_INLINE_IMAGE_BYTES = 3 * 1024 * 1024
+ANALYSIS_CACHE_SIZE = 256
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class ImagePipeline:
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        max_inline_bytes: int = MAX_INLINE_IMAGE_BYTES,
+        cache_size: int = ANALYSIS_CACHE_SIZE
+    ):
+        self.http_client = http_client
+        self.max_inline_bytes = max_inline_bytes
+        self.cache_size = cache_size
+        self._analyses: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    async def fetch(self, location: str) -> Optional[str]:
+        # Returns the URL to hand to the vision model, or None if the file is
+        # not an image. The type is decided from the first bytes, so a
+        # non-image is rejected without downloading the rest of it.
+        with metrics.span("image_download"):
+            return await self._fetch(location)
+
+    async def _fetch(self, location: str) -> Optional[str]:
+        async with self.http_client.stream("GET", location) as response:
+            response.raise_for_status()
+            data = bytearray()
+            mime_type = None
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                data += chunk
+                if mime_type is None and len(data) >= SNIFF_BYTES:
+                    mime_type = sniff_image_type(bytes(data[:SNIFF_BYTES]))
+                    if mime_type is None:
+                        logging.error(f"Image validation failed for URL {location}: unrecognized header {bytes(data[:SNIFF_BYTES])!r}")
+                        return None
+                if len(data) > self.max_inline_bytes:
+                    logging.info(f"Image is larger than {self.max_inline_bytes} bytes, passing it by URL")
+                    return location
+            if mime_type is None:
+                mime_type = sniff_image_type(bytes(data))
+                if mime_type is None:
+                    logging.error(f"Image validation failed for URL {location}: file too short")
+                    return None
+        # Inline the bytes we already have so the model does not fetch them again.
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def get_analysis(self, key: Hashable) -> Optional[str]:
+        analysis = self._analyses.get(key)
+        if analysis is not None:
+            self._analyses.move_to_end(key)
+        metrics.inc("cache_requests_total", cache="image_analysis", result="miss" if analysis is None else "hit")
+        return analysis
+
+    def put_analysis(self, key: Hashable, analysis: str):
+        self._analyses[key] = analysis
+        self._analyses.move_to_end(key)
+        while len(self._analyses) > self.cache_size:
+            self._analyses.popitem(last=False)
@@ -0,0 +1,61 @@
+from typing import Optional
+
+import httpx
+import openai
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+REQUEST_TIMEOUT = 60.0
+
+
+def create_http_client(
+    max_connections: int = MAX_CONNECTIONS,
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+    timeout: float = REQUEST_TIMEOUT
+) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+class LazyHTTPClient:
+    # Builds the client on its first request. Creating one loads the CA
+    # bundle, which is wasted at startup when the bot only downloads files
+    # for the occasional photo or voice note.
+    def __init__(self, **client_kwargs):
+        self.client_kwargs = client_kwargs
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def __getattr__(self, name):
+        if self.client is None:
+            self.client = create_http_client(**self.client_kwargs)
+        return getattr(self.client, name)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+
+def create_llm_client(
+    api_key: str,
+    base_url: str = GROQ_BASE_URL,
+    max_connections: int = MAX_CONNECTIONS,
+    timeout: float = REQUEST_TIMEOUT,
+    max_retries: int = openai.DEFAULT_MAX_RETRIES
+) -> openai.AsyncOpenAI:
+    # One pooled connection set shared by every handler, so concurrent chats
+    # get overlapping requests instead of each opening (or blocking on) its own.
+    http_client = create_http_client(
+        max_connections=max_connections,
+        max_keepalive_connections=max(1, max_connections // 2),
+        timeout=timeout
+    )
+    return openai.AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        http_client=http_client,
+        max_retries=max_retries
+    )
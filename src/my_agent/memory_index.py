@@ -0,0 +1,187 @@
+import hashlib
+from importlib.metadata import PackageNotFoundError, version
+import os
+import re
+from typing import List, Optional, Tuple
+
+# Imported when the first index is opened; see _import_numpy().
+np = None
+
+DIMENSIONS = 128
+SIGNATURE_BITS = 64
+CANDIDATES = 512
+INITIAL_CAPACITY = 1024
+TOP_K = 3
+MIN_SCORE = 0.25
+PROJECTION_SEED = 20250401
+
+MESSAGE = 0
+SUMMARY = 1
+
+WORD_PATTERN = re.compile(r"\w+")
+
+_projection = None
+
+
+def is_available() -> bool:
+    # np.bitwise_count, used for the signature prefilter, needs numpy 2.
+    # Read from the package metadata so checking does not import numpy.
+    try:
+        return int(version("numpy").split(".")[0]) >= 2
+    except (PackageNotFoundError, ValueError):
+        return False
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def _bucket(feature: str) -> Tuple[int, float]:
+    # A stable hash (unlike hash()) keeps vectors valid across restarts.
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % DIMENSIONS, 1.0 if digest >> 63 else -1.0
+
+
+def embed(text: str):
+    # Hashing-trick bag of words and bigrams with sublinear term frequency,
+    # L2-normalised so a dot product is the cosine similarity.
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    words = WORD_PATTERN.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    counts = {}
+    for feature in features:
+        counts[feature] = counts.get(feature, 0) + 1
+    for feature, count in counts.items():
+        index, sign = _bucket(feature)
+        vector[index] += sign * (1.0 + np.log(count))
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def signature(vector) -> int:
+    # Random-hyperplane LSH: the Hamming distance between two signatures
+    # grows with the angle between the vectors, so it is a cheap prefilter.
+    global _projection
+    if _projection is None:
+        _projection = np.random.default_rng(PROJECTION_SEED).standard_normal((SIGNATURE_BITS, DIMENSIONS)).astype(np.float32)
+    bits = np.packbits(_projection @ vector > 0, bitorder="little")
+    return int(bits.view(np.uint64)[0])
+
+
+class MemoryIndex:
+    def __init__(self, directory: str, session_id: str):
+        if not is_available():
+            raise RuntimeError("MemoryIndex requires numpy 2 or newer")
+        _import_numpy()
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^\w-]", "_", session_id)
+        self.vectors_path = os.path.join(directory, f"{name}.vectors")
+        self.signatures_path = os.path.join(directory, f"{name}.signatures")
+        self.ids_path = os.path.join(directory, f"{name}.ids")
+        # Row i of the matrices belongs to the (kind, row id) pair at position
+        # i of the ids file, which is appended after the row is written; its
+        # length is therefore the number of complete rows.
+        ids = np.fromfile(self.ids_path, dtype=np.int64).reshape(-1, 2) if os.path.exists(self.ids_path) else np.zeros((0, 2), dtype=np.int64)
+        self._count = len(ids)
+        self._capacity = 0
+        self._vectors = None
+        self._signatures = None
+        self._ids = np.zeros((0, 2), dtype=np.int64)
+        self._grow(max(INITIAL_CAPACITY, self._count))
+        self._ids[:self._count] = ids
+        self._ids_file = open(self.ids_path, "ab")
+
+    def _open_memmap(self, path: str, dtype, shape):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _grow(self, capacity: int):
+        self.flush()
+        self._vectors = self._open_memmap(self.vectors_path, np.float32, (capacity, DIMENSIONS))
+        self._signatures = self._open_memmap(self.signatures_path, np.uint64, (capacity,))
+        ids = np.zeros((capacity, 2), dtype=np.int64)
+        ids[:self._capacity] = self._ids[:self._capacity]
+        self._ids = ids
+        self._capacity = capacity
+
+    def __len__(self):
+        return self._count
+
+    def last_id(self, kind: int) -> int:
+        ids = self._ids[:self._count]
+        rows = ids[ids[:, 0] == kind]
+        return int(rows[:, 1].max()) if len(rows) else 0
+
+    def add(self, kind: int, row_id: int, text: str):
+        self.add_many([(kind, row_id, text)])
+
+    def add_many(self, rows: List[Tuple[int, int, str]]):
+        if not rows:
+            return
+        needed = self._count + len(rows)
+        if needed > self._capacity:
+            capacity = self._capacity
+            while capacity < needed:
+                capacity *= 2
+            self._grow(capacity)
+        for offset, (_, _, text) in enumerate(rows):
+            vector = embed(text or "")
+            self._vectors[self._count + offset] = vector
+            self._signatures[self._count + offset] = signature(vector)
+        new_ids = np.array([(kind, row_id) for kind, row_id, _ in rows], dtype=np.int64)
+        self._ids[self._count:needed] = new_ids
+        self._ids_file.write(new_ids.tobytes())
+        self._ids_file.flush()
+        self._count = needed
+
+    def search(self, text: str, k: int = TOP_K, before_message_id: Optional[int] = None, min_score: float = MIN_SCORE) -> List[Tuple[int, int, float]]:
+        if self._count == 0 or not text:
+            return []
+        query = embed(text)
+        ids = self._ids[:self._count]
+        excluded = None
+        if before_message_id is not None:
+            # Messages still in the recent window are already in the prompt.
+            excluded = (ids[:, 0] == MESSAGE) & (ids[:, 1] >= before_message_id)
+
+        if self._count <= CANDIDATES * 4:
+            candidates = np.arange(self._count)
+        else:
+            # Prefilter on 8-byte signatures (8 MB per million rows), then
+            # rerank only the closest few hundred rows with exact cosines.
+            distances = np.bitwise_count(self._signatures[:self._count] ^ np.uint64(signature(query)))
+            if excluded is not None:
+                distances[excluded] = SIGNATURE_BITS
+            threshold = np.searchsorted(np.cumsum(np.bincount(distances, minlength=SIGNATURE_BITS + 1)), CANDIDATES)
+            candidates = np.flatnonzero(distances <= threshold)
+
+        scores = self._vectors[candidates] @ query
+        if excluded is not None:
+            scores[excluded[candidates]] = -1.0
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(ids[candidates[i], 0]), int(ids[candidates[i], 1]), float(scores[i]))
+            for i in top
+            if scores[i] >= min_score
+        ]
+
+    def flush(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._signatures.flush()
+
+    def close(self):
+        self.flush()
+        self._vectors = None
+        self._signatures = None
+        self._ids_file.close()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+PREFIX = "my_agent"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_HOST = "127.0.0.1"
+
+_enabled = False
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _key(name: str, labels: Dict[str, object]):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        # Per-bucket counts (the last one past every bound), then the sum and
+        # the count.
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0.0] * (len(DURATION_BUCKETS) + 3)
+        histogram[bisect_left(DURATION_BUCKETS, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage: str, labels: Dict[str, object]):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe("stage_duration_seconds", time.perf_counter() - self.start, stage=self.stage, **self.labels)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            inc("errors_total", stage=self.stage)
+        return False
+
+
+def span(stage: str, **labels):
+    # Times a block into the stage_duration_seconds histogram and counts the
+    # exceptions escaping it. Disabled, this is one flag check.
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(stage, labels)
+
+
+def snapshot() -> dict:
+    # Counters and histogram sums/counts keyed by "name{labels}", for
+    # consumers that want numbers rather than the exposition text.
+    with _lock:
+        counters = {f"{name}{_format_labels(labels)}": value for (name, labels), value in _counters.items()}
+        histograms = {f"{name}{_format_labels(labels)}": {"sum": values[-2], "count": values[-1]} for (name, labels), values in _histograms.items()}
+    return {"counters": counters, "histograms": histograms}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+    lines = []
+    declared = set()
+    for (name, labels), value in counters:
+        if name not in declared:
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            declared.add(name)
+        lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), values in histograms:
+        if name not in declared:
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            declared.add(name)
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, values):
+            cumulative += count
+            lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {_format_value(cumulative)}")
+        lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {_format_value(values[-1])}")
+        lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {values[-2]!r}")
+        lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {_format_value(values[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port: int, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    # Served from a daemon thread so a slow scrape never blocks the event loop.
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -1,100 +1,140 @@
 import json
 from typing import List, Dict
 
-from PIL import Image
-from io import BytesIO
 from dotenv import load_dotenv
 import os
 import logging
 from telegram import Update
-from telegram.ext import filters, MessageHandler, ApplicationBuilder, CommandHandler, ContextTypes
-import openai
+from telegram.ext import filters, MessageHandler, Application, ApplicationBuilder, CommandHandler, ContextTypes
 
+from src.my_agent.archive import Compactor, Shard, ARCHIVE_CHUNK_MESSAGES, COMPACTION_INTERVAL, HOT_MESSAGES
+from src.my_agent.audio import AudioPipeline, MAX_CONCURRENT_TRANSCODES
+from src.my_agent import memory_index, metrics
 from src.my_agent.chat_context_manager import ChatContextManager
-import requests
-import tempfile
-import subprocess
-from tavily import TavilyClient
-
+from src.my_agent.images import ImagePipeline, ANALYSIS_CACHE_SIZE
+from src.my_agent.session_registry import ChatContextRegistry, MAX_SESSIONS
+from src.my_agent.sharding import WorkerPool, create_dispatcher
+from src.my_agent.streaming import StreamingReply, stream_completion
+from src.my_agent.metrics import METRICS_HOST
+from src.my_agent.rate_limiter import RateLimiter, RateLimitedLLMClient, ModelLimits, parse_model_limits, BACKGROUND, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, MAX_RETRIES
+from src.my_agent.llm_client import LazyHTTPClient, create_llm_client, GROQ_BASE_URL, MAX_CONNECTIONS
+
+from src.my_agent.storage import Storage, MAX_PENDING_WRITES
+from src.my_agent.tools.cached_tool import CachedTool, CACHE_TTL, CACHE_MAX_ENTRIES
 from src.my_agent.tools.tool import Tool
+from src.my_agent.tools.tool_executor import ToolExecutor, MAX_TOOL_ROUNDS
+from src.my_agent.tokens import estimate_tokens
 from src.my_agent.tools.web_search_tool import WebSearchTool
+from src.my_agent.turn_scheduler import Turn, TurnScheduler, DEBOUNCE_SECONDS
 
 MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"  # "llama-3.3-70b-versatile"
 PHOTO_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
 TRANSCRIPTION_MODEL = "whisper-large-v3-turbo"
+# Per-model overrides of the LLM_REQUESTS_PER_MINUTE/LLM_TOKENS_PER_MINUTE
+# defaults; Whisper is metered in audio seconds rather than tokens.
+MODEL_LIMITS = "whisper-large-v3-turbo=20:0"
 BASE_CONTEXT = "You are a helpful bot."
 MAX_HISTORY_MESSAGES = 20
 GROUP_SIZE_LEVEL_0 = 5
 GROUP_SIZE_HIGHER_LEVELS = 5
 MAX_SUMMARY_LEVEL = 3
+MAX_CONTEXT_TOKENS = 6000
+MEMORY_DIR = "memory_index"
+CONCURRENT_UPDATES = 64
+STREAM_RESPONSES = "true"
+WORKERS = 1
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 3000
+WEBHOOK_PATH = "telegram"
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-async def handle_chat_response(text, update, context, ctx, model, base_context, groq_client, tools: Dict[str, Tool]):
+def record_token_usage(model, usage):
+    if usage is not None:
+        metrics.inc("llm_tokens_total", usage.prompt_tokens or 0, model=model, kind="prompt")
+        metrics.inc("llm_tokens_total", usage.completion_tokens or 0, model=model, kind="completion")
+
+async def get_completion(groq_client, reply: StreamingReply = None, **kwargs):
+    model = kwargs.get("model")
+    with metrics.span("llm_completion", model=model):
+        if reply is not None:
+            content, tool_calls = await stream_completion(groq_client, reply, **kwargs)
+            # Streamed chunks carry no usage; count an estimate of the output.
+            metrics.inc("llm_tokens_total", estimate_tokens(content or ""), model=model, kind="completion_estimated")
+            return content, tool_calls
+        chat_completion = await groq_client.chat.completions.create(**kwargs)
+    logging.debug(f"get_completion: completion object: {chat_completion}")
+    record_token_usage(model, chat_completion.usage)
+    message = chat_completion.choices[0].message
+    return message.content, message.tool_calls
+
+async def send_response(update, context, reply: StreamingReply, text):
+    if reply is not None:
+        await reply.finish()
+    else:
+        with metrics.span("telegram_send"):
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+
+async def handle_chat_response(text, update, context, ctx, model, base_context, groq_client, tools: Dict[str, Tool], stream: bool = False, max_tool_rounds: int = MAX_TOOL_ROUNDS, turn: Turn = None):
     try:
         logging.debug(f"handle_chat_response: input text: {text}")
-        ctx.add_message("user", text)
+        await ctx.add_message("user", text)
+        # From here until the reply starts going out, newer input may cancel
+        # this generation; the next turn then answers both.
+        if turn is not None:
+            turn.begin()
+        on_start = turn.commit if turn is not None else None
         tools_context = " ".join([tool.base_context() for tool in tools.values()])
-        context_messages = ctx.get_context(system_prompt=f"{base_context} {tools_context} Use the available tools when necessary. Do not generate tool calls manually — use tool_calls field.")
+        with metrics.span("context_assembly"):
+            context_messages = ctx.get_context(system_prompt=f"{base_context} {tools_context} Use the available tools when necessary. Do not generate tool calls manually — use tool_calls field.")
         logging.debug(f"handle_chat_response: prompt/context: {context_messages}")
         logging.debug(f"handle_chat_response: using model: {model}")
         # await context.bot.send_message(chat_id=update.effective_chat.id, text=f">>>>>>>message: {context_messages}\nmodel: {model}\ntools: {[tool.description() for tool in tools.values()]}\ntool_choice: auto")
-        chat_completion = groq_client.chat.completions.create(
-            messages=context_messages,
-            model=model,
-            tools=[tool.description() for tool in tools.values()],
-            tool_choice="auto"
-        )
-        logging.debug(f"handle_chat_response: completion object: {chat_completion}")
-        response = chat_completion.choices[0].message.content
-        logging.debug(f"handle_chat_response: generated response: {response}")
-
-        tool_calls = chat_completion.choices[0].message.tool_calls
-        logging.debug(f"handle_chat_response: generated tool_calls: {tool_calls}")
-        msg = chat_completion.choices[0].message
-        # await context.bot.send_message(chat_id=update.effective_chat.id, text=str(msg))
-        if tool_calls:
+        # With streaming, the reply message is sent on the first tokens and then
+        # edited in place as the rest of the completion arrives.
+        reply = StreamingReply(context.bot, update.effective_chat.id, on_start=on_start) if stream else None
+        executor = ToolExecutor(tools)
+        tool_round = 0
+        while True:
+            completion_args = {"messages": context_messages, "model": model}
+            # Tools are offered until the round limit; the last pass must answer.
+            if tools and tool_round < max_tool_rounds:
+                completion_args["tools"] = [tool.description() for tool in tools.values()]
+                completion_args["tool_choice"] = "auto"
+            response, tool_calls = await get_completion(groq_client, reply, **completion_args)
+            logging.debug(f"handle_chat_response: generated response: {response}")
+            logging.debug(f"handle_chat_response: generated tool_calls: {tool_calls}")
+            if not tool_calls:
+                break
+            tool_round += 1
             context_messages.append({
                 "role": "assistant",
-                "content": response
-            })
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_to_call = tools[function_name]
-                function_args = json.loads(tool_call.function.arguments)
-                logging.debug(f"handle_chat_response: tool_call function name: {function_name}; args: {function_args}")
-                # await context.bot.send_message(chat_id=update.effective_chat.id, text=f">>>{function_name}: {function_args}<<<")
-                # Call the tool and get the response
-                function_response = function_to_call.call(
-                    parameters=function_args
-                )
-                logging.debug(f"handle_chat_response: {function_name} function response: {function_response}")
-                # Add the tool response to the conversation
-                context_messages.append(
+                "content": response,
+                "tool_calls": [
                     {
-                        "role": "tool", # Indicates this message is from tool use
-                        "tool_call_id": tool_call.id,
-                        "content": json.dumps(function_response),
+                        "id": tool_call.id,
+                        "type": "function",
+                        "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
                     }
-                )
-            # Make a second API call with the updated conversation
-            second_response = groq_client.chat.completions.create(
-                model=model,
-                messages=context_messages
-            )
-            logging.debug(f"handle_chat_response: second completion object: {second_response}")
-            # Return the final response
-            second_content = second_response.choices[0].message.content
-            ctx.add_message("assistant", second_content)
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=second_content)
-        else:
-            ctx.add_message("assistant", response)
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+                    for tool_call in tool_calls
+                ]
+            })
+            # Add the tool responses to the conversation
+            context_messages.extend(await executor.run(tool_calls))
+            if reply is not None and reply.started:
+                await reply.finish()
+                reply = StreamingReply(context.bot, update.effective_chat.id, on_start=on_start)
+
+        if turn is not None:
+            turn.commit()
+        await ctx.add_message("assistant", response)
+        await send_response(update, context, reply, response)
     except Exception as e:
         logging.error(f"Error in handle_chat_response: {e}", exc_info=True)
+        metrics.inc("failed_updates_total", stage="chat_response")
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, something went wrong while generating a response.")
 
 def create_start_function(model, photo_model):
@@ -102,23 +142,72 @@ def create_start_function(model, photo_model):
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"I'm a bot, please talk to me!\nI'm using model {model}!\nFor photo I'm using model {photo_model}!")
     return start
 
-def create_echo_function(groq_client, model, base_context, ctx: ChatContextManager, tools):
+def instrument_handler(name, handler):
+    async def instrumented(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with metrics.span("handle_update", handler=name):
+            await handler(update, context)
+    return instrumented
+
+def get_chat_context(contexts: ChatContextRegistry, update: Update) -> ChatContextManager:
+    return contexts.get(str(update.effective_chat.id))
+
+def create_turn_function(groq_client, model, base_context, contexts: ChatContextRegistry, tools, stream: bool = False, max_tool_rounds: int = MAX_TOOL_ROUNDS):
+    async def run_turn(text, update: Update, context: ContextTypes.DEFAULT_TYPE, turn: Turn):
+        ctx = get_chat_context(contexts, update)
+        await handle_chat_response(text, update, context, ctx, model, base_context, groq_client, tools, stream, max_tool_rounds, turn)
+    return run_turn
+
+def create_echo_function(groq_client, model, base_context, contexts: ChatContextRegistry, tools, stream: bool = False, max_tool_rounds: int = MAX_TOOL_ROUNDS, turns: TurnScheduler = None):
     async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.message or not update.message.text:
             logging.warning("No message or text found in update.")
             return
-        await handle_chat_response(update.message.text, update, context, ctx, model, base_context, groq_client, tools)
+        if turns is not None:
+            await turns.submit(str(update.effective_chat.id), update.message.text, update, context)
+            return
+        ctx = get_chat_context(contexts, update)
+        await handle_chat_response(update.message.text, update, context, ctx, model, base_context, groq_client, tools, stream, max_tool_rounds)
     return echo
 
-def create_photo_function(groq_client, photo_model, ctx: ChatContextManager):
+def create_photo_function(groq_client, photo_model, contexts: ChatContextRegistry, image_pipeline: ImagePipeline, turns: TurnScheduler = None):
+    async def add_analysis(update: Update, ctx: ChatContextManager, analysis: str):
+        # Through the chat's turn lock, so an analysis is never stored
+        # between a running turn's input and its reply.
+        if turns is None:
+            await ctx.add_message("user", analysis)
+            return
+        async with turns.exclusive(str(update.effective_chat.id)):
+            await ctx.add_message("user", analysis)
+
     async def photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        idx = len(update.message.photo)-1
-        file_id = update.message.photo[idx].file_id
-        file = await context.bot.getFile(file_id)
-        location = file.file_path
+        ctx = get_chat_context(contexts, update)
+        photo_size = update.message.photo[-1]
         caption = update.message.caption
+        # file_unique_id is stable across forwards and re-sends of the same photo.
+        analysis_key = (photo_size.file_unique_id, caption or "")
+        cached = image_pipeline.get_analysis(analysis_key)
+        if cached is not None:
+            logging.info(f"Reusing analysis of photo {photo_size.file_unique_id}")
+            await add_analysis(update, ctx, cached)
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=cached)
+            return
+
+        file = await context.bot.getFile(photo_size.file_id)
+        location = file.file_path
         logging.info(f"Received photo with file path: {location}")
         logging.info(f"Caption: {caption}")
+
+        logging.info("Checking if the file is a valid image...")
+        try:
+            image_url = await image_pipeline.fetch(location)
+        except Exception as e:
+            logging.error(f"Image download failed for URL {location}: {e}")
+            image_url = None
+        if image_url is None:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="The specified file is not an image.")
+            return
+
+        logging.info(f"Image passed validation: {location}")
         messages = [
             {
                 "role": "system",
@@ -134,7 +223,7 @@ def create_photo_function(groq_client, photo_model, ctx: ChatContextManager):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": location
+                            "url": image_url
                         }
                     }
                 ]
@@ -147,119 +236,104 @@ def create_photo_function(groq_client, photo_model, ctx: ChatContextManager):
                 "content": caption
             })
 
-        logging.info("Checking if the file is a valid image...")
-        if is_valid_image(location):
-            logging.info(f"Image passed validation: {location}")
-            try:
-                completion = groq_client.chat.completions.create(
+        try:
+            with metrics.span("llm_completion", model=photo_model):
+                completion = await groq_client.chat.completions.create(
                     messages=messages,
                     model=photo_model,
                 )
-                response = completion.choices[0].message.content
-                ctx.add_message("user", response)
-                await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
-            except Exception as e:
-                logging.error(f"Error during image completion: {e}")
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, something went wrong while analyzing the image.")
-        else:
-            await context.bot.send_message(chat_id=update.effective_chat.id, text="The specified file is not an image.")
+            record_token_usage(photo_model, completion.usage)
+            response = completion.choices[0].message.content
+            image_pipeline.put_analysis(analysis_key, response)
+            await add_analysis(update, ctx, response)
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+        except Exception as e:
+            logging.error(f"Error during image completion: {e}")
+            metrics.inc("failed_updates_total", stage="photo")
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, something went wrong while analyzing the image.")
     return photo
 
-def create_transcription_function(groq_client, transcription_model, ctx: ChatContextManager, tools):
+def create_transcription_function(groq_client, transcription_model, contexts: ChatContextRegistry, tools, audio_pipeline: AudioPipeline, stream: bool = False, max_tool_rounds: int = MAX_TOOL_ROUNDS, turns: TurnScheduler = None):
     async def transcription(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        file_id = update.message.voice.file_id
-        file = await context.bot.getFile(file_id)
+        ctx = get_chat_context(contexts, update)
+        voice = update.message.voice
+        file = await context.bot.getFile(voice.file_id)
         location = file.file_path
         logging.info(f"Received audio with file path: {location}")
 
         try:
-            response = requests.get(location, timeout=10)
-            response.raise_for_status()
-
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as ogg_file:
-                ogg_file.write(response.content)
-                ogg_path = ogg_file.name
-
-            mp3_path = ogg_path.replace(".ogg", ".mp3")
-            subprocess.run([
-                "ffmpeg",
-                "-y",
-                "-i", ogg_path,
-                "-acodec", "libmp3lame",
-                mp3_path
-            ], check=True)
-
-            with open(mp3_path, "rb") as mp3_file:
-                transcript = groq_client.audio.transcriptions.create(
-                    file=mp3_file,
+            # Audio stays in memory: it is either uploaded as downloaded or
+            # streamed through ffmpeg's pipes when the format needs converting.
+            file_name, audio = await audio_pipeline.fetch_for_transcription(location, voice.mime_type)
+            with metrics.span("transcription", model=transcription_model):
+                transcript = await groq_client.audio.transcriptions.create(
+                    file=(file_name, audio),
                     model=transcription_model,
                 )
-                response = transcript.text
-                logging.debug(f"Transcript result: {response!r}")
-                ctx.add_message("user", response)
-                await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
-                if not response.strip():
-                    logging.warning("Transcript was empty, skipping chat response.")
-                    return
+            response = transcript.text
+            logging.debug(f"Transcript result: {response!r}")
+            # Shown to the user, but stored by the turn that answers it.
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+            if not response.strip():
+                logging.warning("Transcript was empty, skipping chat response.")
+                return
+
+            if turns is not None:
+                await turns.submit(str(update.effective_chat.id), response, update, context)
+                return
 
             logging.info("Calling handle_chat_response with transcript result.")
-            await handle_chat_response(response, update, context, ctx, MODEL, BASE_CONTEXT, groq_client, tools)
+            await handle_chat_response(response, update, context, ctx, MODEL, BASE_CONTEXT, groq_client, tools, stream, max_tool_rounds)
 
         except Exception as e:
             logging.error(f"Error during transcription: {e}")
+            metrics.inc("failed_updates_total", stage="transcription")
             await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, something went wrong while transcribing the audio.")
 
-        finally:
-            try:
-                os.remove(ogg_path)
-                os.remove(mp3_path)
-            except Exception as e:
-                logging.warning(f"Could not delete temporary files: {e}")
-
     return transcription
 
 def generate_summary(groq_client, model):
-    def summarize(messages: List[Dict[str, str]]) -> str:
-        response = groq_client.chat.completions.create(
+    async def summarize(messages: List[Dict[str, str]]) -> str:
+        # Nobody is waiting on a summary: interactive requests go first.
+        response = await groq_client.chat.completions.create(
+            priority=BACKGROUND,
             model=model,
             messages=[
                 {"role": "system", "content": "Create a concise summary of the following conversation between the user and the assistant. Summarize in a clear and structured way using bullet points if helpful. Focus on key questions, concepts, and answers. Omit small talk."},
                 {"role": "user", "content": json.dumps(messages, ensure_ascii=False)}
             ]
         )
+        record_token_usage(model, response.usage)
         return response.choices[0].message.content.strip()
     return summarize
 
-def is_valid_image(url):
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        Image.open(BytesIO(response.content))
-        return True
-    except Exception as e:
-        logging.error(f"Image validation failed for URL {url}: {e}")
-        return False
-
-def create_tools(tavily_client: TavilyClient) -> dict[str, Tool]:
+def create_tools(tavily_client=None, storage: Storage = None, cache_ttl: float = CACHE_TTL, cache_max_entries: int = CACHE_MAX_ENTRIES, tavily_api_key: str = None) -> dict[str, Tool]:
+    # Without a client, WebSearchTool creates one from the key on first use.
     return {
-        "web_search": WebSearchTool(tavily_client),
+        "web_search": CachedTool(WebSearchTool(tavily_client, tavily_api_key), ttl=cache_ttl, max_entries=cache_max_entries, storage=storage),
     }
 
-def main():
-    load_dotenv()
-
-    telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    assert telegram_token is not None, "Telegram token is missing. Check the TELEGRAM_BOT_TOKEN environment variable."
-
+def create_application(telegram_token: str, updater: bool = True, shard: Shard = None) -> Application:
     groq_token = os.getenv("GROQ_API_KEY")
     assert groq_token is not None, "Groq token is missing. Check the GROQ_API_KEY environment variable."
-    groq_client = openai.OpenAI(
-        base_url="https://api.groq.com/openai/v1",
-        api_key=groq_token
+    # Retries are left to the rate limiter, which backs off per model and
+    # lets interactive requests overtake background summarization.
+    limiter = RateLimiter(
+        default_limits=ModelLimits(
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", REQUESTS_PER_MINUTE)) or None,
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", TOKENS_PER_MINUTE)) or None
+        ),
+        limits=parse_model_limits(os.getenv("LLM_MODEL_LIMITS", MODEL_LIMITS)),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", MAX_RETRIES))
     )
+    groq_client = RateLimitedLLMClient(create_llm_client(
+        api_key=groq_token,
+        base_url=os.getenv("GROQ_BASE_URL", GROQ_BASE_URL),
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", MAX_CONNECTIONS)),
+        max_retries=0
+    ), limiter)
     tavily_key = os.getenv("TAVILY_API_KEY")
     assert tavily_key is not None, "Tavily key is missing. Check the TAVILY_API_KEY environment variable."
-    tavily_client = TavilyClient(api_key=tavily_key)
 
     model = os.getenv("MODEL", MODEL)
     photo_model = os.getenv("PHOTO_MODEL", PHOTO_MODEL)
@@ -269,32 +343,150 @@ def main():
     group_size_level_0 = int(os.getenv("GROUP_SIZE_LEVEL_0", GROUP_SIZE_LEVEL_0))
     group_size_higher_levels = int(os.getenv("GROUP_SIZE_HIGHER_LEVELS", GROUP_SIZE_HIGHER_LEVELS))
     max_summary_level = int(os.getenv("MAX_SUMMARY_LEVEL", MAX_SUMMARY_LEVEL))
+    max_context_tokens = int(os.getenv("MAX_CONTEXT_TOKENS", MAX_CONTEXT_TOKENS))
+    memory_dir = os.getenv("MEMORY_DIR", MEMORY_DIR) or None
+    if memory_dir is not None and not memory_index.is_available():
+        logging.warning("numpy 2 is not installed (install the memory extra), semantic memory is disabled")
+        memory_dir = None
+    stream = os.getenv("STREAM_RESPONSES", STREAM_RESPONSES).lower() in ("1", "true", "yes")
+    max_tool_rounds = int(os.getenv("MAX_TOOL_ROUNDS", MAX_TOOL_ROUNDS))
+
+    # Sharded workers share the database, so they commit every write at once
+    # instead of holding the write lock across a grouped commit.
+    max_pending_writes = int(os.getenv("MAX_PENDING_WRITES", MAX_PENDING_WRITES if updater else 1))
 
     summarize_fn = generate_summary(groq_client, model)
-    ctx = ChatContextManager(
-        session_id="my_session",
+    contexts = ChatContextRegistry(
+        max_sessions=int(os.getenv("MAX_SESSIONS", MAX_SESSIONS)),
+        max_pending_writes=max_pending_writes,
         max_history_messages=max_history_messages,
         summarize_fn=summarize_fn,
         group_size_level_0=group_size_level_0,
         group_size_higher_levels=group_size_higher_levels,
-        max_summary_level=max_summary_level
+        max_summary_level=max_summary_level,
+        max_context_tokens=max_context_tokens,
+        memory_dir=memory_dir
     )
 
-    tools: Dict[str, Tool] = create_tools(tavily_client)
+    tools: Dict[str, Tool] = create_tools(
+        storage=contexts.storage,
+        cache_ttl=float(os.getenv("TOOL_CACHE_TTL", CACHE_TTL)),
+        cache_max_entries=int(os.getenv("TOOL_CACHE_MAX_ENTRIES", CACHE_MAX_ENTRIES)),
+        tavily_api_key=tavily_key
+    )
     
-    application = ApplicationBuilder().token(telegram_token).build()
+    metrics_port = os.getenv("METRICS_PORT")
+    metrics_server = None
+    if metrics_port:
+        metrics.enable()
+        metrics_server = metrics.start_http_server(int(metrics_port), os.getenv("METRICS_HOST", METRICS_HOST))
+
+    # Photos and voice notes are rare next to text; their download client is
+    # built on the first one.
+    download_client = LazyHTTPClient()
+    audio_pipeline = AudioPipeline(
+        download_client,
+        max_concurrent_transcodes=int(os.getenv("MAX_CONCURRENT_TRANSCODES", MAX_CONCURRENT_TRANSCODES))
+    )
+    image_pipeline = ImagePipeline(
+        download_client,
+        cache_size=int(os.getenv("IMAGE_ANALYSIS_CACHE_SIZE", ANALYSIS_CACHE_SIZE))
+    )
+
+    # Turns of one chat run one at a time; a burst of messages becomes a
+    # single turn. TURN_DEBOUNCE=0 still serializes but does not wait.
+    turns = TurnScheduler(
+        create_turn_function(groq_client, model, base_context, contexts, tools, stream, max_tool_rounds),
+        debounce=float(os.getenv("TURN_DEBOUNCE", DEBOUNCE_SECONDS))
+    )
+
+    # Moves summarized history out of the hot messages table and returns the
+    # freed pages to the filesystem. COMPACTION_INTERVAL=0 disables it.
+    compactor = None
+    compaction_interval = float(os.getenv("COMPACTION_INTERVAL", COMPACTION_INTERVAL))
+    if compaction_interval > 0:
+        compactor = Compactor(
+            contexts.archive,
+            interval=compaction_interval,
+            hot_messages=max(int(os.getenv("HOT_MESSAGES", HOT_MESSAGES)), max_history_messages + 1),
+            chunk_messages=int(os.getenv("ARCHIVE_CHUNK_MESSAGES", ARCHIVE_CHUNK_MESSAGES)),
+            shard=shard
+        )
+
+    async def start_background(_application):
+        if compactor is not None:
+            compactor.start()
+
+    async def close_clients(_application):
+        if compactor is not None:
+            await compactor.close()
+        await turns.close()
+        await contexts.close()
+        await groq_client.close()
+        await download_client.aclose()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    builder = (
+        ApplicationBuilder()
+        .token(telegram_token)
+        .concurrent_updates(int(os.getenv("CONCURRENT_UPDATES", CONCURRENT_UPDATES)))
+        .post_init(start_background)
+        .post_shutdown(close_clients)
+    )
+    telegram_base_url = os.getenv("TELEGRAM_BASE_URL")
+    if telegram_base_url:
+        # A local Bot API server, or a fake one in the startup benchmark.
+        builder = builder.base_url(telegram_base_url)
+    if not updater:
+        # Sharded workers get their updates from the dispatcher process.
+        builder = builder.updater(None)
+    application = builder.build()
 
     start_handler = CommandHandler('start', create_start_function(model, photo_model))
-    echo_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), create_echo_function(groq_client, model, base_context, ctx, tools))
-    photo_handler = MessageHandler(filters.PHOTO, create_photo_function(groq_client, photo_model, ctx))
-    transcription_handler = MessageHandler(filters.VOICE, create_transcription_function(groq_client, transcription_model, ctx, tools))
+    echo_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), instrument_handler("text", create_echo_function(groq_client, model, base_context, contexts, tools, stream, max_tool_rounds, turns)))
+    photo_handler = MessageHandler(filters.PHOTO, instrument_handler("photo", create_photo_function(groq_client, photo_model, contexts, image_pipeline, turns)))
+    transcription_handler = MessageHandler(filters.VOICE, instrument_handler("voice", create_transcription_function(groq_client, transcription_model, contexts, tools, audio_pipeline, stream, max_tool_rounds, turns)))
 
     application.add_handler(start_handler)
     application.add_handler(echo_handler)
     application.add_handler(photo_handler)
     application.add_handler(transcription_handler)
+    return application
+
+def run_application(application: Application):
+    # With WEBHOOK_URL set (the public URL Telegram should call, ending in
+    # WEBHOOK_PATH), updates are pushed to a local server instead of polled.
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:
+        application.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", WEBHOOK_LISTEN),
+            port=int(os.getenv("WEBHOOK_PORT", WEBHOOK_PORT)),
+            url_path=os.getenv("WEBHOOK_PATH", WEBHOOK_PATH),
+            webhook_url=webhook_url,
+            secret_token=os.getenv("WEBHOOK_SECRET")
+        )
+    else:
+        application.run_polling()
+
+def main():
+    load_dotenv()
+
+    telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
+    assert telegram_token is not None, "Telegram token is missing. Check the TELEGRAM_BOT_TOKEN environment variable."
 
-    application.run_polling()
+    workers = int(os.getenv("WORKERS", WORKERS))
+    if workers > 1:
+        # This process only receives updates and shards them by chat across
+        # worker processes, each running its own copy of the bot.
+        metrics_port = os.getenv("METRICS_PORT")
+        if metrics_port:
+            metrics.enable()
+            metrics.start_http_server(int(metrics_port), os.getenv("METRICS_HOST", METRICS_HOST))
+        pool = WorkerPool(create_application, telegram_token, workers)
+        run_application(create_dispatcher(telegram_token, pool, os.getenv("TELEGRAM_BASE_URL")))
+    else:
+        run_application(create_application(telegram_token))
 
 if __name__ == '__main__':
     main()
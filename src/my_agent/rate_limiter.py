@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import openai
+
+from src.my_agent import metrics
+from src.my_agent.tokens import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Groq's free tier limits for the default models.
+REQUESTS_PER_MINUTE = 30
+TOKENS_PER_MINUTE = 30000
+# Background requests leave this share of each bucket to interactive turns.
+BACKGROUND_RESERVE = 0.2
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# After a 429 the number of requests in flight per model is capped, halved
+# on each further 429 and grown by one per success until it passes this.
+MAX_WINDOW = 32
+COMPLETION_TOKENS_RESERVE = 512
+IMAGE_TOKENS = 1000
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+@dataclass
+class ModelLimits:
+    requests_per_minute: Optional[float] = REQUESTS_PER_MINUTE
+    tokens_per_minute: Optional[float] = TOKENS_PER_MINUTE
+
+
+def parse_model_limits(value: str) -> Dict[str, ModelLimits]:
+    # "model=requests:tokens,..." per minute; an empty or 0 field is no limit.
+    limits = {}
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        model, _, numbers = entry.partition("=")
+        requests, _, tokens = numbers.partition(":")
+        limits[model.strip()] = ModelLimits(
+            requests_per_minute=float(requests or 0) or None,
+            tokens_per_minute=float(tokens or 0) or None
+        )
+    return limits
+
+
+def estimate_request_tokens(request: dict) -> int:
+    total = 0
+    for message in request.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text") or "")
+                else:
+                    total += IMAGE_TOKENS
+        elif content:
+            total += estimate_tokens(content)
+        total += MESSAGE_OVERHEAD_TOKENS
+    return total + (request.get("max_completion_tokens") or request.get("max_tokens") or COMPLETION_TOKENS_RESERVE)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.requests = float(limits.requests_per_minute or 0)
+        self.tokens = float(limits.tokens_per_minute or 0)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.window: Optional[float] = None
+        self.waiters: List[tuple] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.limits.requests_per_minute:
+            self.requests = min(self.limits.requests_per_minute, self.requests + elapsed * self.limits.requests_per_minute / 60)
+        if self.limits.tokens_per_minute:
+            self.tokens = min(self.limits.tokens_per_minute, self.tokens + elapsed * self.limits.tokens_per_minute / 60)
+
+    def delay(self, tokens: int, reserve: float, now: float) -> float:
+        # Seconds until the request fits while leaving `reserve` of the
+        # bucket untouched; a request larger than the bucket waits for a full one.
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        rate = self.limits.requests_per_minute
+        if rate:
+            needed = min(rate, 1 + reserve * rate)
+            if self.requests < needed:
+                wait = max(wait, (needed - self.requests) * 60 / rate)
+        rate = self.limits.tokens_per_minute
+        if rate and tokens:
+            needed = min(rate, tokens + reserve * rate)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) * 60 / rate)
+        return wait
+
+    def take(self, tokens: int):
+        if self.limits.requests_per_minute:
+            self.requests -= 1
+        if self.limits.tokens_per_minute:
+            self.tokens -= min(tokens, self.limits.tokens_per_minute)
+
+    def block(self, seconds: float):
+        # The server said stop: hold every request for this model, not just
+        # the one that was rejected.
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        # Without this, everything queued behind the block would be released
+        # at once when it expires and be throttled again together.
+        self.window = max(1.0, min(self.window or MAX_WINDOW, self.in_flight / 2))
+
+    def succeeded(self):
+        if self.window is not None:
+            self.window += 1
+            if self.window > MAX_WINDOW:
+                self.window = None
+
+    def full(self) -> bool:
+        return self.window is not None and self.in_flight >= self.window
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        default_limits: ModelLimits = None,
+        limits: Dict[str, ModelLimits] = None,
+        background_reserve: float = BACKGROUND_RESERVE,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY
+    ):
+        self.default_limits = default_limits or ModelLimits()
+        self.limits = dict(limits or {})
+        self.background_reserve = background_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: Dict[str, _Bucket] = {}
+        self._sequence = itertools.count()
+
+    def _bucket(self, model: str) -> _Bucket:
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            bucket = self._buckets[model] = _Bucket(self.limits.get(model, self.default_limits))
+        return bucket
+
+    async def acquire(self, model: str, priority: int = INTERACTIVE, tokens: int = 0):
+        # Every acquire must be paired with a release once the request ends.
+        bucket = self._bucket(model)
+        future = asyncio.get_running_loop().create_future()
+        # Waiters are served by priority, then in arrival order.
+        heapq.heappush(bucket.waiters, (priority, next(self._sequence), tokens, future))
+        self._dispatch(bucket)
+        try:
+            with metrics.span("rate_limit_wait", priority="interactive" if priority == INTERACTIVE else "background"):
+                await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(model)
+            raise
+
+    def release(self, model: str):
+        bucket = self._bucket(model)
+        bucket.in_flight -= 1
+        self._dispatch(bucket)
+
+    def _dispatch(self, bucket: _Bucket):
+        if bucket.timer is not None:
+            bucket.timer.cancel()
+            bucket.timer = None
+        now = time.monotonic()
+        # A full window is reopened by release(), not by a timer.
+        while bucket.waiters and not bucket.full():
+            priority, _, tokens, future = bucket.waiters[0]
+            if future.done():
+                heapq.heappop(bucket.waiters)
+                continue
+            reserve = self.background_reserve if priority > INTERACTIVE else 0.0
+            wait = bucket.delay(tokens, reserve, now)
+            if wait > 0:
+                bucket.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, bucket)
+                return
+            heapq.heappop(bucket.waiters)
+            bucket.take(tokens)
+            bucket.in_flight += 1
+            future.set_result(None)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps clients that failed together from retrying together.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, model: str, priority: int, request: Callable[[], Awaitable], tokens: int = 0):
+        attempt = 0
+        while True:
+            await self.acquire(model, priority, tokens)
+            bucket = self._bucket(model)
+            try:
+                response = await request()
+                bucket.succeeded()
+                return response
+            except RETRYABLE_ERRORS as e:
+                delay = retry_after_seconds(e)
+                delay = self._backoff(attempt) if delay is None else delay + random.uniform(0, delay / 10)
+                if isinstance(e, openai.RateLimitError):
+                    bucket.block(delay)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                metrics.inc("llm_retries_total", model=model, reason=type(e).__name__)
+                logging.warning(f"RateLimiter: {type(e).__name__} for {model}, retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            finally:
+                self.release(model)
+            await asyncio.sleep(delay)
+
+
+class RateLimitedLLMClient:
+    # Exposes the parts of AsyncOpenAI the bot uses, routing every request
+    # through the limiter. Callers pass priority=BACKGROUND for work nobody
+    # is waiting on.
+    def __init__(self, client: openai.AsyncOpenAI, limiter: RateLimiter):
+        self.client = client
+        self.limiter = limiter
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._create_transcription))
+
+    async def _create_completion(self, priority: int = INTERACTIVE, **kwargs):
+        return await self.limiter.call(
+            kwargs.get("model"),
+            priority,
+            lambda: self.client.chat.completions.create(**kwargs),
+            estimate_request_tokens(kwargs)
+        )
+
+    async def _create_transcription(self, priority: int = INTERACTIVE, **kwargs):
+        return await self.limiter.call(
+            kwargs.get("model"),
+            priority,
+            lambda: self.client.audio.transcriptions.create(**kwargs)
+        )
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Set
+
+from src.my_agent.archive import MessageArchive
+from src.my_agent.chat_context_manager import ChatContextManager
+from src.my_agent.storage import Storage, MAX_PENDING_WRITES
+
+MAX_SESSIONS = 256
+
+
+class ChatContextRegistry:
+    def __init__(
+        self,
+        db_path: str = "chat_history.db",
+        max_sessions: int = MAX_SESSIONS,
+        max_pending_writes: int = MAX_PENDING_WRITES,
+        **manager_kwargs
+    ):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.manager_kwargs = manager_kwargs
+        self.storage = Storage(self.db_path, max_pending_writes=max_pending_writes)
+        self.archive = MessageArchive(self.storage)
+        self._sessions: "OrderedDict[str, ChatContextManager]" = OrderedDict()
+        self._retiring: Dict[str, ChatContextManager] = {}
+        self._retire_tasks: Set[asyncio.Task] = set()
+
+    def get(self, session_id: str) -> ChatContextManager:
+        ctx = self._sessions.get(session_id)
+        if ctx is not None:
+            self._sessions.move_to_end(session_id)
+            return ctx
+
+        # A session evicted a moment ago may still be finishing its summaries;
+        # reuse it rather than letting two workers summarize the same history.
+        ctx = self._retiring.pop(session_id, None)
+        if ctx is None:
+            ctx = ChatContextManager(
+                db_path=self.db_path,
+                session_id=session_id,
+                storage=self.storage,
+                archive=self.archive,
+                **self.manager_kwargs
+            )
+            logging.debug(f"ChatContextRegistry: opened session {session_id}")
+        self._sessions[session_id] = ctx
+        self._evict()
+        return ctx
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            session_id, ctx = self._sessions.popitem(last=False)
+            logging.debug(f"ChatContextRegistry: evicting idle session {session_id}")
+            self._retiring[session_id] = ctx
+            try:
+                task = asyncio.get_running_loop().create_task(self._retire(session_id, ctx))
+            except RuntimeError:
+                self._retiring.pop(session_id, None)
+                continue
+            self._retire_tasks.add(task)
+            task.add_done_callback(self._retire_tasks.discard)
+
+    async def _retire(self, session_id: str, ctx: ChatContextManager):
+        await ctx.wait_for_summaries()
+        if self._retiring.get(session_id) is ctx:
+            del self._retiring[session_id]
+            await ctx.close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def close(self):
+        for task in list(self._retire_tasks):
+            await task
+        for ctx in list(self._sessions.values()) + list(self._retiring.values()):
+            await ctx.close()
+        self._sessions.clear()
+        self._retiring.clear()
+        self.storage.close()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Callable, List
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, ContextTypes, TypeHandler
+
+from src.my_agent import metrics
+
+WORKER_SHUTDOWN_TIMEOUT = 30.0
+
+# Builds a fully wired Application for a worker; called with the bot token,
+# updater=False and shard=(index, workers).
+ApplicationFactory = Callable[..., Application]
+
+
+def shard_for(update: Update, workers: int) -> int:
+    # Every update of a chat goes to the same worker, so one process owns a
+    # chat's history, turn scheduling and memory index.
+    if update.effective_chat is not None:
+        key = update.effective_chat.id
+    elif update.effective_user is not None:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % workers
+
+
+def run_worker(factory: ApplicationFactory, telegram_token: str, index: int, workers: int, queue: multiprocessing.Queue):
+    # Shutdown is driven by the dispatcher, which sends None once it stops
+    # receiving updates; Ctrl+C reaches the whole process group.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        # One endpoint per process: the dispatcher keeps METRICS_PORT and
+        # worker i serves on METRICS_PORT + 1 + i.
+        os.environ["METRICS_PORT"] = str(int(metrics_port) + 1 + index)
+    logging.info(f"Worker {index}: starting")
+    application = factory(telegram_token, updater=False, shard=(index, workers))
+    asyncio.run(_serve(application, queue))
+    logging.info(f"Worker {index}: stopped")
+
+
+async def _serve(application: Application, queue: multiprocessing.Queue):
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            # The update queue applies the application's concurrent_updates
+            # limit, as it does for updates fetched by an updater.
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+class WorkerPool:
+    def __init__(self, factory: ApplicationFactory, telegram_token: str, workers: int):
+        self.factory = factory
+        self.telegram_token = telegram_token
+        # spawn rather than fork: workers must not inherit SQLite connections
+        # or sockets from the parent.
+        self._context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [self._context.Queue() for _ in range(workers)]
+        self.processes: List[multiprocessing.Process] = [None] * workers
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._start(index)
+
+    def _start(self, index: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.factory, self.telegram_token, index, len(self.queues), self.queues[index]),
+            name=f"worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+
+    def dispatch(self, update: Update):
+        index = shard_for(update, len(self.queues))
+        if not self.processes[index].is_alive():
+            logging.error(f"WorkerPool: worker {index} exited with code {self.processes[index].exitcode}, restarting it")
+            self._start(index)
+        self.queues[index].put(update.to_dict())
+        metrics.inc("dispatched_updates_total", worker=index)
+
+    async def stop(self, timeout: float = WORKER_SHUTDOWN_TIMEOUT):
+        for queue in self.queues:
+            queue.put(None)
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logging.warning(f"WorkerPool: worker {index} did not stop within {timeout}s, terminating it")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+
+
+def create_dispatcher(telegram_token: str, pool: WorkerPool, base_url: str = None) -> Application:
+    # Receives updates (by polling or webhook) and only forwards them; all
+    # handling happens in the workers.
+    async def forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        pool.dispatch(update)
+
+    async def start_workers(_application):
+        pool.start()
+
+    async def stop_workers(_application):
+        await pool.stop()
+
+    builder = (
+        ApplicationBuilder()
+        .token(telegram_token)
+        .post_init(start_workers)
+        .post_shutdown(stop_workers)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, forward))
+    return application
@@ -0,0 +1,307 @@
+import asyncio
+import contextlib
+import logging
+import sqlite3
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from src.my_agent import metrics
+from src.my_agent.tokens import estimate_tokens
+
+COMMIT_INTERVAL = 0.05
+MAX_PENDING_WRITES = 64
+BUSY_TIMEOUT_MS = 5000
+# Backoff while another process holds the write lock, see Storage.awrite().
+LOCK_RETRY_DELAY = 0.002
+MAX_LOCK_RETRY_DELAY = 0.05
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _migration_1(conn: sqlite3.Connection):
+    # Baseline schema; IF NOT EXISTS lets pre-versioning databases adopt it.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT,
+            content TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            level INTEGER,
+            start_msg_id INTEGER,
+            end_msg_id INTEGER,
+            summary_text TEXT
+        )
+    """)
+
+
+def _migration_2(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_session_id
+        ON messages (session_id, id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_summaries_session_level_end
+        ON summaries (session_id, level, end_msg_id)
+    """)
+
+
+def _migration_3(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tool_cache (
+            tool TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            result TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (tool, cache_key)
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tool_cache_expires_at
+        ON tool_cache (expires_at)
+    """)
+
+
+def _migration_4(conn: sqlite3.Connection):
+    conn.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+    conn.execute("ALTER TABLE summaries ADD COLUMN token_count INTEGER")
+    conn.create_function("estimate_tokens", 1, estimate_tokens, deterministic=True)
+    conn.execute("UPDATE messages SET token_count = estimate_tokens(content)")
+    conn.execute("UPDATE summaries SET token_count = estimate_tokens(summary_text)")
+
+
+def _migration_5(conn: sqlite3.Connection):
+    # A range is summarized once per level; with several processes writing,
+    # the index turns a repeated summary into a no-op instead of a duplicate.
+    conn.execute("""
+        DELETE FROM summaries WHERE id NOT IN (
+            SELECT MIN(id) FROM summaries GROUP BY session_id, level, start_msg_id
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_summaries_session_level_start
+        ON summaries (session_id, level, start_msg_id)
+    """)
+
+
+def _migration_6(conn: sqlite3.Connection):
+    # Cold tier for summarized history; see archive.MessageArchive.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            start_msg_id INTEGER NOT NULL,
+            end_msg_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_message_archive_session_end
+        ON message_archive (session_id, end_msg_id)
+    """)
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    current = get_schema_version(conn)
+    if current >= SCHEMA_VERSION:
+        return current
+    # Worker processes may open the database at the same moment: the write
+    # lock lets one of them migrate while the others wait and then find the
+    # schema up to date.
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = get_schema_version(conn)
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            logging.info(f"Storage: migrating schema from version {current} to {version}")
+            migration(conn)
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            current = version
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return current
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Takes effect on a new database, but only before anything is written to
+    # it, switching to WAL included; an existing one is rebuilt by
+    # Storage.enable_incremental_vacuum().
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode NORMAL only gives up durability of the last commits on power
+    # loss, never consistency, and avoids an fsync per transaction.
+    conn.execute("PRAGMA synchronous = NORMAL")
+    migrate(conn)
+    return conn
+
+
+def is_busy(error: sqlite3.OperationalError) -> bool:
+    # SQLITE_BUSY and its extended codes, e.g. SQLITE_BUSY_SNAPSHOT.
+    return (getattr(error, "sqlite_errorcode", 0) & 0xff) == sqlite3.SQLITE_BUSY
+
+
+class Storage:
+    def __init__(
+        self,
+        db_path: str = "chat_history.db",
+        commit_interval: float = COMMIT_INTERVAL,
+        max_pending_writes: int = MAX_PENDING_WRITES,
+        lock_timeout: float = BUSY_TIMEOUT_MS / 1000
+    ):
+        self.db_path = db_path
+        self.commit_interval = commit_interval
+        self.max_pending_writes = max_pending_writes
+        self.lock_timeout = lock_timeout
+        self.conn = connect(db_path)
+        # SQLite's busy handler sleeps inside the call, which would stall the
+        # event loop while another process writes. Storage retries instead,
+        # awaiting between attempts in the async methods.
+        self.conn.execute("PRAGMA busy_timeout = 0")
+        self._pending_writes = 0
+        self._commit_handle: Optional[asyncio.TimerHandle] = None
+        # The connection has one transaction at a time: while a transaction()
+        # waits for or holds the write lock, an awrite() would open Python's
+        # implicit one under it, and vice versa.
+        self._transaction_lock = asyncio.Lock()
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, parameters)
+
+    def _attempt(self, statement: Callable[[], sqlite3.Cursor]) -> Optional[sqlite3.Cursor]:
+        # None if another process holds the write lock.
+        try:
+            return statement()
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                raise
+            if not self._pending_writes and self.conn.in_transaction:
+                # The transaction never got the lock; a retry inside it would
+                # keep reading its stale snapshot.
+                self.conn.rollback()
+            return None
+
+    def _retry(self, statement: Callable[[], sqlite3.Cursor]) -> sqlite3.Cursor:
+        # Blocking variant for code that runs without an event loop.
+        deadline = time.monotonic() + self.lock_timeout
+        delay = LOCK_RETRY_DELAY
+        while (cursor := self._attempt(statement)) is None:
+            if time.monotonic() >= deadline:
+                raise sqlite3.OperationalError("database is locked")
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_LOCK_RETRY_DELAY)
+        return cursor
+
+    async def _aretry(self, statement: Callable[[], sqlite3.Cursor]) -> sqlite3.Cursor:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_timeout
+        delay = LOCK_RETRY_DELAY
+        while (cursor := self._attempt(statement)) is None:
+            if loop.time() >= deadline:
+                raise sqlite3.OperationalError("database is locked")
+            metrics.inc("db_lock_waits_total")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_LOCK_RETRY_DELAY)
+        return cursor
+
+    async def enable_incremental_vacuum(self) -> bool:
+        # Without it pages freed by compaction are only reused, never returned
+        # to the filesystem. Switching an existing database needs one full
+        # VACUUM, which rewrites the whole file, so the compactor runs it once
+        # in the background instead of every process at startup.
+        if self.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        async with self._transaction_lock:
+            self.commit()
+            logging.info("Storage: rebuilding the database for incremental vacuum")
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await self._aretry(lambda: self.conn.execute("VACUUM"))
+        return True
+
+    def write(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        # Writes are grouped into one transaction that is committed after
+        # commit_interval or max_pending_writes, whichever comes first. Reads
+        # on the same connection see uncommitted rows immediately.
+        cursor = self._retry(lambda: self.conn.execute(sql, parameters))
+        self._written()
+        return cursor
+
+    async def awrite(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        # As write(), but waits for the write lock without blocking the loop.
+        async with self._transaction_lock:
+            cursor = await self._aretry(lambda: self.conn.execute(sql, parameters))
+            self._written()
+        return cursor
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[sqlite3.Connection]:
+        # A transaction holding the write lock, e.g. for compaction, committed
+        # on exit and rolled back on error. awrite() waits until it ends, so
+        # the body must not call it.
+        async with self._transaction_lock:
+            self.commit()
+            await self._aretry(lambda: self.conn.execute("BEGIN IMMEDIATE"))
+            try:
+                yield self.conn
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.max_pending_writes:
+            self.commit()
+        else:
+            self._schedule_commit()
+
+    def _schedule_commit(self):
+        if self._commit_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.commit()
+            return
+        self._commit_handle = loop.call_later(self.commit_interval, self.commit)
+
+    def commit(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if self._pending_writes:
+            with metrics.span("db_commit"):
+                self.conn.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Tuple
+
+from telegram.error import BadRequest, RetryAfter
+
+from src.my_agent import metrics
+
+EDIT_INTERVAL = 1.0
+MAX_MESSAGE_LENGTH = 4096
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class StreamingReply:
+    def __init__(self, bot, chat_id, edit_interval: float = EDIT_INTERVAL, on_start: Optional[Callable[[], None]] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        # Called before anything is sent, e.g. to make the turn uncancellable.
+        self.on_start = on_start
+        self.text = ""
+        self._offset = 0  # start of the part shown in the current Telegram message
+        self._message = None
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._message is not None
+
+    async def append(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        if self._message is None:
+            await self._send(self.text[self._offset:self._offset + MAX_MESSAGE_LENGTH])
+        elif len(self.text) - self._offset > MAX_MESSAGE_LENGTH:
+            await self._roll_over()
+        elif time.monotonic() >= self._next_edit_at:
+            await self._edit(self.text[self._offset:], final=False)
+
+    async def finish(self) -> str:
+        while len(self.text) - self._offset > MAX_MESSAGE_LENGTH:
+            await self._roll_over()
+        if self._message is None:
+            if self.text:
+                await self._send(self.text[self._offset:])
+        else:
+            await self._edit(self.text[self._offset:], final=True)
+        return self.text
+
+    async def _roll_over(self):
+        # Telegram caps a message at 4096 characters: freeze the full one and
+        # continue the stream in a new message.
+        await self._edit(self.text[self._offset:self._offset + MAX_MESSAGE_LENGTH], final=True)
+        self._offset += MAX_MESSAGE_LENGTH
+        self._message = None
+        self._shown = ""
+        rest = self.text[self._offset:self._offset + MAX_MESSAGE_LENGTH]
+        if rest:
+            await self._send(rest)
+
+    async def _send(self, text: str):
+        if self.on_start is not None:
+            self.on_start()
+        while True:
+            try:
+                with metrics.span("telegram_send"):
+                    self._message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+                break
+            except RetryAfter as e:
+                metrics.inc("telegram_retry_after_total")
+                await asyncio.sleep(retry_after_seconds(e))
+        self._shown = text
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _edit(self, text: str, final: bool):
+        if text == self._shown:
+            return
+        while True:
+            try:
+                with metrics.span("telegram_edit"):
+                    await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self._message.message_id)
+                break
+            except RetryAfter as e:
+                metrics.inc("telegram_retry_after_total")
+                # Intermediate edits are best effort; only the final text must land.
+                self._next_edit_at = time.monotonic() + retry_after_seconds(e)
+                if not final:
+                    return
+                await asyncio.sleep(retry_after_seconds(e))
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                break
+        self._shown = text
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+
+async def stream_completion(groq_client, reply: Optional[StreamingReply], **kwargs) -> Tuple[str, List[SimpleNamespace]]:
+    content = ""
+    tool_calls = {}
+    stream = await groq_client.chat.completions.create(stream=True, **kwargs)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content += delta.content
+            if reply is not None:
+                await reply.append(delta.content)
+        # Tool calls arrive in fragments keyed by index; stitch them back together.
+        for tool_call in delta.tool_calls or []:
+            entry = tool_calls.setdefault(tool_call.index, SimpleNamespace(
+                id=None,
+                type="function",
+                function=SimpleNamespace(name="", arguments="")
+            ))
+            if tool_call.id:
+                entry.id = tool_call.id
+            if tool_call.function:
+                entry.function.name += tool_call.function.name or ""
+                entry.function.arguments += tool_call.function.arguments or ""
+    logging.debug(f"stream_completion: streamed {len(content)} characters, {len(tool_calls)} tool calls")
+    return content, [tool_calls[index] for index in sorted(tool_calls)]
@@ -0,0 +1,87 @@
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class SummaryEntry:
+    level: int
+    start_msg_id: int
+    end_msg_id: int
+    token_count: int
+    summary_text: Optional[str] = None
+
+
+class SummaryIndex:
+    def __init__(self, load_text: Callable[[SummaryEntry], str]):
+        # load_text fetches the text of a summary that is no longer part of
+        # the cover; only cover entries keep their text in memory.
+        self.load_text = load_text
+        self._by_start: Dict[int, Dict[int, SummaryEntry]] = {}
+        self._level_0_starts: List[int] = []
+        self._cover: List[SummaryEntry] = []
+        self._cover_starts: List[int] = []
+        self._cover_ends: List[int] = []
+
+    def add(self, entry: SummaryEntry):
+        self._by_start.setdefault(entry.level, {})[entry.start_msg_id] = entry
+        if entry.level == 0:
+            index = bisect_left(self._level_0_starts, entry.start_msg_id)
+            self._level_0_starts.insert(index, entry.start_msg_id)
+
+        # The cover is the smallest set of non-overlapping summaries spanning
+        # everything summarized so far: a new summary replaces the entries it
+        # spans, unless an existing entry already spans it.
+        i = bisect_left(self._cover_starts, entry.start_msg_id)
+        if i > 0 and self._cover[i - 1].end_msg_id >= entry.end_msg_id:
+            entry.summary_text = None
+            return
+        if i < len(self._cover) and self._cover[i].start_msg_id == entry.start_msg_id and self._cover[i].end_msg_id >= entry.end_msg_id:
+            entry.summary_text = None
+            return
+        j = i
+        while j < len(self._cover) and self._cover[j].end_msg_id <= entry.end_msg_id:
+            self._cover[j].summary_text = None
+            j += 1
+        self._cover[i:j] = [entry]
+        self._cover_starts[i:j] = [entry.start_msg_id]
+        self._cover_ends[i:j] = [entry.end_msg_id]
+
+    def __len__(self):
+        return len(self._cover)
+
+    @property
+    def end_msg_id(self) -> int:
+        # Every message up to here is summarized.
+        return self._cover_ends[-1] if self._cover_ends else 0
+
+    def cover_until(self, msg_id: int) -> List[SummaryEntry]:
+        # Cover entries are disjoint and sorted, so every entry ending at or
+        # before msg_id is a prefix of the list.
+        k = bisect_right(self._cover_ends, msg_id)
+        pieces = self._cover[:k]
+        if k < len(self._cover) and self._cover[k].start_msg_id <= msg_id:
+            pieces.extend(self._descend(self._cover[k].start_msg_id, msg_id))
+        return pieces
+
+    def _descend(self, position: int, msg_id: int) -> List[SummaryEntry]:
+        # An entry straddles msg_id: cover its part greedily with the highest
+        # level summary that starts at each position and still fits.
+        pieces = []
+        levels = sorted(self._by_start, reverse=True)
+        while True:
+            entry = None
+            for level in levels:
+                candidate = self._by_start[level].get(position)
+                if candidate is not None and candidate.end_msg_id <= msg_id:
+                    entry = candidate
+                    break
+            if entry is None:
+                return pieces
+            if entry.summary_text is None:
+                entry = SummaryEntry(entry.level, entry.start_msg_id, entry.end_msg_id, entry.token_count, self.load_text(entry))
+            pieces.append(entry)
+            next_index = bisect_right(self._level_0_starts, entry.end_msg_id)
+            if next_index == len(self._level_0_starts):
+                return pieces
+            position = self._level_0_starts[next_index]
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+
+class SummaryScheduler:
+    def __init__(self, update_fn: Callable[[], Awaitable[int]], name: str = "summaries"):
+        self.update_fn = update_fn
+        self.name = name
+        self._pending = False
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name=f"summary-worker-{self.name}")
+
+    async def _run(self):
+        # Coalesce notifications: one catch-up pass covers every insert that
+        # happened while the previous pass was running.
+        while self._pending:
+            self._pending = False
+            try:
+                created = await self.update_fn()
+                logging.debug(f"SummaryScheduler[{self.name}]: created {created} summaries")
+            except Exception as e:
+                logging.error(f"SummaryScheduler[{self.name}]: summarization failed: {e}", exc_info=True)
+                return
+
+    async def drain(self):
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._pending = False
@@ -0,0 +1,14 @@
+import re
+from typing import Optional
+
+# BPE tokenizers average roughly four characters per token; splitting words
+# into four-character pieces and counting punctuation separately tracks that
+# closely for any language without shipping a tokenizer.
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return len(TOKEN_PATTERN.findall(text))
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.my_agent import metrics
+from src.my_agent.storage import Storage
+from src.my_agent.tools.tool import Tool
+
+CACHE_TTL = 3600.0
+CACHE_MAX_ENTRIES = 512
+PRUNE_EVERY_WRITES = 100
+
+
+def normalize_parameters(parameters) -> str:
+    # "Who is Messi?" and "who is  messi" should share one cache entry, but
+    # symbols inside the query carry meaning ("2+2" vs "2-2", "C++" vs "C#"),
+    # so only case, whitespace and trailing punctuation are normalized.
+    def normalize(value):
+        if isinstance(value, str):
+            return " ".join(value.lower().split()).rstrip("?!.").rstrip()
+        if isinstance(value, dict):
+            return {key: normalize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        return value
+    return json.dumps(normalize(parameters or {}), sort_keys=True, ensure_ascii=False)
+
+
+class CachedTool(Tool):
+    def __init__(
+        self,
+        tool: Tool,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        storage: Optional[Storage] = None
+    ):
+        self.tool = tool
+        self.name = tool.description()["function"]["name"]
+        self.timeout = tool.timeout
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._writes = 0
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def description(self):
+        return self.tool.description()
+
+    def base_context(self):
+        return self.tool.base_context()
+
+    def call(self, parameters):
+        # Synchronous callers may run on a worker thread, where the SQLite
+        # connection cannot be used, so this path only consults memory.
+        key = normalize_parameters(parameters)
+        found, result = self._get_memory(key)
+        if found:
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache=self.name, result="hit")
+            return result
+        self.misses += 1
+        metrics.inc("cache_requests_total", cache=self.name, result="miss")
+        result = self.tool.call(parameters)
+        if self._is_cacheable(result):
+            self._put_memory(key, result)
+        return result
+
+    async def acall(self, parameters):
+        key = normalize_parameters(parameters)
+        found, result = self._get_memory(key)
+        if not found:
+            found, result = self._get_persisted(key)
+        if found:
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache=self.name, result="hit")
+            logging.debug(f"CachedTool[{self.name}]: cache hit for {key}")
+            return result
+
+        # Concurrent misses for the same key share one call to the tool. It
+        # runs as its own task, so a caller timing out does not cancel it for
+        # the others.
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            metrics.inc("cache_requests_total", cache=self.name, result="miss")
+            task = self._in_flight[key] = asyncio.ensure_future(self._fetch(key, parameters))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache=self.name, result="in_flight")
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, parameters):
+        result = await self.tool.acall(parameters)
+        if self._is_cacheable(result):
+            self._put_memory(key, result)
+            await self._persist(key, result)
+        return result
+
+    @staticmethod
+    def _is_cacheable(result) -> bool:
+        return result is not None and not (isinstance(result, dict) and "error" in result)
+
+    def _get_memory(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, result
+
+    def _put_memory(self, key: str, result, expires_at: Optional[float] = None):
+        self._entries[key] = (expires_at or time.time() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_persisted(self, key: str):
+        if self.storage is None:
+            return False, None
+        row = self.storage.execute("""
+            SELECT result, expires_at FROM tool_cache
+            WHERE tool = ? AND cache_key = ? AND expires_at >= ?
+        """, (self.name, key, time.time())).fetchone()
+        if row is None:
+            return False, None
+        result = json.loads(row[0])
+        self._put_memory(key, result, expires_at=row[1])
+        return True, result
+
+    async def _persist(self, key: str, result):
+        if self.storage is None:
+            return
+        try:
+            payload = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        now = time.time()
+        await self.storage.awrite("""
+            INSERT OR REPLACE INTO tool_cache (tool, cache_key, result, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, (self.name, key, payload, now + self.ttl))
+        self._writes += 1
+        if self._writes % PRUNE_EVERY_WRITES == 0:
+            await self.storage.awrite("DELETE FROM tool_cache WHERE expires_at < ?", (now,))
@@ -1,4 +1,9 @@
+import asyncio
+
+
 class Tool:
+    timeout = 30.0
+
     def description(self):
         pass
 
@@ -7,3 +12,8 @@ class Tool:
 
     def call(self, parameters):
         pass
+
+    async def acall(self, parameters):
+        # Blocking tools run on a worker thread so they never stall the event
+        # loop; natively async tools override this instead of call().
+        return await asyncio.to_thread(self.call, parameters)
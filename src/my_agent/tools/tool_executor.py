@@ -0,0 +1,57 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+from src.my_agent import metrics
+from src.my_agent.tools.tool import Tool
+
+MAX_TOOL_ROUNDS = 3
+
+
+class ToolExecutor:
+    def __init__(self, tools: Dict[str, Tool], timeout: Optional[float] = None):
+        self.tools = tools
+        self.timeout = timeout
+
+    async def run(self, tool_calls) -> List[Dict[str, str]]:
+        # All calls of a turn run concurrently; gather keeps the model's order
+        # and cancels the remaining calls if the turn itself is cancelled.
+        return list(await asyncio.gather(*(self._run_one(tool_call) for tool_call in tool_calls)))
+
+    async def _run_one(self, tool_call) -> Dict[str, str]:
+        function_name = tool_call.function.name
+        result = await self._call(function_name, tool_call.function.arguments)
+        logging.debug(f"ToolExecutor: {function_name} function response: {result}")
+        return {
+            "role": "tool",  # Indicates this message is from tool use
+            "tool_call_id": tool_call.id,
+            "content": json.dumps(result),
+        }
+
+    async def _call(self, function_name: str, arguments: str):
+        tool = self.tools.get(function_name)
+        if tool is None:
+            metrics.inc("tool_calls_total", tool=function_name, outcome="unknown")
+            return {"error": f"Unknown tool '{function_name}'."}
+        try:
+            function_args = json.loads(arguments or "{}")
+        except json.JSONDecodeError as e:
+            metrics.inc("tool_calls_total", tool=function_name, outcome="bad_arguments")
+            return {"error": f"Invalid arguments for '{function_name}': {e}"}
+
+        logging.debug(f"ToolExecutor: tool_call function name: {function_name}; args: {function_args}")
+        timeout = self.timeout if self.timeout is not None else tool.timeout
+        try:
+            with metrics.span("tool_call", tool=function_name):
+                result = await asyncio.wait_for(tool.acall(function_args), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"ToolExecutor: {function_name} timed out after {timeout}s")
+            metrics.inc("tool_calls_total", tool=function_name, outcome="timeout")
+            return {"error": f"'{function_name}' timed out."}
+        except Exception as e:
+            logging.error(f"ToolExecutor: {function_name} failed: {e}", exc_info=True)
+            metrics.inc("tool_calls_total", tool=function_name, outcome="error")
+            return {"error": f"'{function_name}' failed: {e}"}
+        metrics.inc("tool_calls_total", tool=function_name, outcome="ok")
+        return result
@@ -1,10 +1,25 @@
+import asyncio
+
 from src.my_agent.tools.tool import Tool
 
 
 class WebSearchTool(Tool):
+    timeout = 15.0
+
+    def __init__(self, tavily_client=None, api_key: str = None):
+        # tavily_client is an AsyncTavilyClient or anything with an async
+        # search(query).
+        self._tavily_client = tavily_client
+        self.api_key = api_key
 
-    def __init__(self, tavily_client):
-        self.tavily_client = tavily_client
+    @property
+    def tavily_client(self):
+        # tavily (and requests under it) is imported with the first search,
+        # not at startup.
+        if self._tavily_client is None:
+            from tavily import AsyncTavilyClient
+            self._tavily_client = AsyncTavilyClient(api_key=self.api_key)
+        return self._tavily_client
 
     def description(self):
         return {
@@ -29,7 +44,12 @@ class WebSearchTool(Tool):
         return "Use the web_search function to retrieve live data from the internet."
 
     def call(self, parameters):
+        return asyncio.run(self.acall(parameters))
+
+    async def acall(self, parameters):
+        # Natively async, so a timeout in ToolExecutor cancels the request
+        # itself instead of leaving it running on a worker thread.
         question = parameters.get("question")
         if not question:
             return {"error": "Missing 'question' parameter."}
-        return self.tavily_client.search(question)
+        return await self.tavily_client.search(question)
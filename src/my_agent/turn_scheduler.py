@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from src.my_agent import metrics
+
+DEBOUNCE_SECONDS = 0.5
+MAX_DEBOUNCE_SECONDS = 3.0
+
+
+class Turn:
+    # A generation may be thrown away once its input is in the history and
+    # until the first part of its reply is about to reach the user.
+    def __init__(self):
+        self.cancellable = False
+        self.committed = False
+
+    def begin(self):
+        if not self.committed:
+            self.cancellable = True
+
+    def commit(self):
+        self.cancellable = False
+        self.committed = True
+
+
+RunTurn = Callable[[str, Any, Any, Turn], Awaitable[None]]
+
+
+class _ChatTurns:
+    def __init__(self):
+        self.pending: List[Tuple[str, Any, Any, asyncio.Future]] = []
+        self.first_input_at: Optional[float] = None
+        self.last_input_at = 0.0
+        self.turn: Optional[Turn] = None
+        self.turn_task: Optional[asyncio.Task] = None
+        self.worker: Optional[asyncio.Task] = None
+
+
+class TurnScheduler:
+    def __init__(
+        self,
+        run_turn: RunTurn,
+        debounce: float = DEBOUNCE_SECONDS,
+        max_debounce: float = MAX_DEBOUNCE_SECONDS,
+        separator: str = "\n"
+    ):
+        self.run_turn = run_turn
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+        self.separator = separator
+        self._chats: Dict[Hashable, _ChatTurns] = {}
+        # Per-chat lock and its number of holders and waiters.
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def exclusive(self, key: Hashable):
+        # Held by every running turn. Other writers to a chat's history, e.g.
+        # photo analyses, take it too so they never land between a turn's
+        # input and its reply.
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def submit(self, key: Hashable, text: str, update, context):
+        # Returns once the turn that answered this text has finished.
+        loop = asyncio.get_running_loop()
+        state = self._chats.get(key)
+        if state is None:
+            state = self._chats[key] = _ChatTurns()
+        waiter = loop.create_future()
+        state.pending.append((text, update, context, waiter))
+        now = loop.time()
+        if state.first_input_at is None:
+            state.first_input_at = now
+        state.last_input_at = now
+
+        if state.turn is not None and state.turn.cancellable:
+            # Nothing has been sent for the running turn: drop its generation.
+            # Its input is already in the history, so the next turn answers it
+            # together with the new text.
+            logging.info(f"TurnScheduler: new input in chat {key}, cancelling the unsent reply")
+            state.turn.cancellable = False
+            state.turn_task.cancel()
+        if state.worker is None:
+            state.worker = loop.create_task(self._work(key, state))
+        await waiter
+
+    async def _work(self, key: Hashable, state: _ChatTurns):
+        loop = asyncio.get_running_loop()
+        carried: List[asyncio.Future] = []
+        try:
+            while state.pending:
+                # Wait for a quiet moment so a burst becomes one turn, but not
+                # longer than max_debounce after its first message.
+                while True:
+                    deadline = min(state.last_input_at + self.debounce, state.first_input_at + self.max_debounce)
+                    delay = deadline - loop.time()
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+
+                inputs, state.pending = state.pending, []
+                state.first_input_at = None
+                waiters = carried + [waiter for *_, waiter in inputs]
+                text = self.separator.join(text for text, *_ in inputs)
+                _, update, context, _ = inputs[-1]
+                if len(inputs) > 1:
+                    logging.debug(f"TurnScheduler: coalesced {len(inputs)} messages in chat {key}")
+                    metrics.inc("coalesced_messages_total", len(inputs) - 1)
+
+                async with self.exclusive(key):
+                    state.turn = Turn()
+                    state.turn_task = loop.create_task(self.run_turn(text, update, context, state.turn))
+                    task = state.turn_task
+                    try:
+                        await asyncio.wait([task])
+                    finally:
+                        state.turn = None
+                        state.turn_task = None
+                        if not task.done():
+                            task.cancel()
+
+                if task.cancelled():
+                    metrics.inc("turns_total", outcome="cancelled")
+                    carried = waiters
+                    continue
+                carried = []
+                metrics.inc("turns_total", outcome="completed")
+                if task.exception() is not None:
+                    logging.error(f"TurnScheduler: turn failed in chat {key}: {task.exception()}", exc_info=task.exception())
+                self._release(waiters)
+        finally:
+            self._release(carried + [waiter for *_, waiter in state.pending])
+            state.pending = []
+            state.worker = None
+            if self._chats.get(key) is state:
+                del self._chats[key]
+
+    @staticmethod
+    def _release(waiters: List[asyncio.Future]):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def close(self):
+        workers = [state.worker for state in self._chats.values() if state.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
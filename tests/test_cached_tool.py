@@ -0,0 +1,58 @@
+import asyncio
+
+from src.my_agent.tools.cached_tool import CachedTool, normalize_parameters
+from src.my_agent.tools.tool import Tool
+
+
+def key(question: str) -> str:
+    return normalize_parameters({"question": question})
+
+
+def test_case_whitespace_and_trailing_punctuation_share_a_key():
+    assert key("Who is Messi?") == key("who is  messi") == key(" WHO is messi ?! ")
+
+
+def test_symbols_inside_the_query_are_kept():
+    assert key("what is 2+2") != key("what is 2-2")
+    assert len({key("C++ tutorial"), key("C# tutorial"), key("C tutorial")}) == 3
+    assert key("$100 in EUR") != key("100 in EUR")
+
+
+class CountingTool(Tool):
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def description(self):
+        return {"type": "function", "function": {"name": "counting"}}
+
+    def call(self, parameters):
+        self.calls += 1
+        return self.result
+
+    async def acall(self, parameters):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return self.result
+
+
+def test_errors_are_not_cached():
+    tool = CountingTool({"error": "rate limited"})
+    cached = CachedTool(tool)
+    cached.call({"question": "who is messi"})
+    cached.call({"question": "who is messi"})
+    asyncio.run(cached.acall({"question": "who is messi"}))
+    assert tool.calls == 3
+
+
+def test_concurrent_misses_share_one_call():
+    tool = CountingTool({"results": ["Lionel Messi"]})
+    cached = CachedTool(tool)
+
+    async def run():
+        return await asyncio.gather(*(cached.acall({"question": question}) for question in ("Who is Messi?", "who is messi", "WHO IS MESSI")))
+
+    results = asyncio.run(run())
+    assert tool.calls == 1
+    assert results == [{"results": ["Lionel Messi"]}] * 3
+    assert cached.misses == 1
@@ -0,0 +1,60 @@
+import asyncio
+
+from src.my_agent import memory_index
+from src.my_agent.chat_context_manager import ChatContextManager
+
+
+async def summarize(messages):
+    return "S[" + ",".join(message["content"] for message in messages) + "]"
+
+
+def test_context_has_no_gap_between_summaries_and_window(tmp_path):
+    async def run():
+        db_path = str(tmp_path / "chat_history.db")
+        ctx = ChatContextManager(db_path, max_history_messages=20, summarize_fn=summarize)
+        for i in range(1, 48):
+            await ctx.add_message("user", f"m{i}")
+        await ctx.wait_for_summaries()
+        live = ctx.get_context()
+        await ctx.close()
+
+        reloaded = ChatContextManager(db_path, max_history_messages=20, summarize_fn=summarize)
+        cold = reloaded.get_context()
+        await reloaded.close()
+        return live, cold
+
+    live, cold = asyncio.run(run())
+    assert live == cold
+    summaries, *messages = live
+    # Groups of five up to m25 are summarized; m26 and m27 are older than the
+    # window of 20 but not summarized yet.
+    assert summaries["role"] == "system"
+    assert "m25]" in summaries["content"] and "m26" not in summaries["content"]
+    assert [message["content"] for message in messages] == [f"m{i}" for i in range(26, 48)]
+
+
+def test_memory_catches_up_in_background(tmp_path):
+    async def run():
+        db_path = str(tmp_path / "chat_history.db")
+        ctx = ChatContextManager(db_path, summarize_fn=summarize)
+        for i in range(1, 301):
+            await ctx.add_message("user", f"m{i}")
+        await ctx.wait_for_summaries()
+        await ctx.close()
+
+        # Opened with an empty index, the whole backlog has to be embedded.
+        ctx = ChatContextManager(db_path, summarize_fn=summarize, memory_dir=str(tmp_path / "memory"))
+        pending = ctx._memory_catch_up is not None and len(ctx._memory) == 0
+        await ctx.add_message("user", "m301")
+        await ctx._memory_catch_up
+        last_id = ctx._memory.last_id(memory_index.MESSAGE)
+        indexed = len(ctx._memory)
+        summaries = ctx.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        await ctx.close()
+        return pending, last_id, indexed - summaries
+
+    pending, last_id, indexed = asyncio.run(run())
+    assert pending
+    # Messages written meanwhile are indexed by the catch-up, in order.
+    assert last_id == 301
+    assert indexed == 301
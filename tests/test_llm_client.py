@@ -0,0 +1,43 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeBot, FakeLLMServer, text_update
+from src.my_agent.llm_client import create_llm_client
+from src.my_agent.my_agent import BASE_CONTEXT, MODEL, handle_chat_response
+from src.my_agent.session_registry import ChatContextRegistry
+
+LATENCY = 0.5
+CHATS = 8
+
+
+async def summarize(messages):
+    return "summary"
+
+
+def test_concurrent_updates_overlap(tmp_path):
+    async def run():
+        with FakeLLMServer(latency=LATENCY, time_to_first_token=0) as llm:
+            client = create_llm_client(api_key="fake", base_url=f"{llm.url}/openai/v1", max_retries=0)
+            contexts = ChatContextRegistry(str(tmp_path / "chat_history.db"), summarize_fn=summarize)
+            context = SimpleNamespace(bot=FakeBot("http://127.0.0.1", latency=0))
+
+            async def chat(chat_id: int):
+                update = text_update(chat_id, f"hello from chat {chat_id}")
+                ctx = contexts.get(str(chat_id))
+                await handle_chat_response(update.message.text, update, context, ctx, MODEL, BASE_CONTEXT, client, {})
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(chat(chat_id) for chat_id in range(CHATS)))
+            elapsed = time.perf_counter() - t0
+
+            await contexts.close()
+            await client.close()
+            return elapsed, llm.counts.get("chat", 0), context.bot.sent
+
+    elapsed, completions, sent = asyncio.run(run())
+    assert completions == CHATS
+    assert sent == CHATS
+    # Blocking calls would take CHATS * LATENCY; overlapping ones about one.
+    # The bound leaves room for connection setup on a loaded machine.
+    assert elapsed < CHATS * LATENCY / 2
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from benchmarks.fakes import FakeLLMServer
+from src.my_agent.llm_client import create_llm_client
+from src.my_agent.rate_limiter import BACKGROUND, INTERACTIVE, ModelLimits, RateLimitedLLMClient, RateLimiter, parse_model_limits
+
+MODEL = "fake-model"
+
+
+def limited_client(llm: FakeLLMServer, limits: ModelLimits = None, max_retries: int = 10) -> RateLimitedLLMClient:
+    # Without limits the limiter only learns about them from 429s.
+    limiter = RateLimiter(limits or ModelLimits(None, None), max_retries=max_retries)
+    return RateLimitedLLMClient(create_llm_client(api_key="fake", base_url=f"{llm.url}/openai/v1", max_retries=0), limiter)
+
+
+async def complete(client: RateLimitedLLMClient, priority: int):
+    return await client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": "hello"}], priority=priority)
+
+
+def test_interactive_requests_overtake_queued_background_work():
+    async def run():
+        # A bucket of 60 requests refilled at one per second; background work
+        # leaves the last 12 to interactive turns.
+        limiter = RateLimiter(ModelLimits(requests_per_minute=60, tokens_per_minute=None))
+        granted = []
+
+        async def request(name: str, priority: int):
+            await limiter.acquire(MODEL, priority)
+            granted.append(name)
+            limiter.release(MODEL)
+
+        background = [asyncio.create_task(request("background", BACKGROUND)) for _ in range(50)]
+        await asyncio.sleep(0)
+        # The last of these has to queue for a refill, ahead of the two
+        # background requests already waiting.
+        await asyncio.gather(*(request("interactive", INTERACTIVE) for _ in range(13)))
+        order = list(granted)
+
+        # Cancelled waiters must not hold on to a slot.
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        return order, limiter._bucket(MODEL)
+
+    order, bucket = asyncio.run(run())
+    assert order == ["background"] * 48 + ["interactive"] * 13
+    assert bucket.in_flight == 0 and all(future.done() for *_, future in bucket.waiters)
+
+
+def test_interactive_request_succeeds_while_background_saturates_the_server():
+    async def run():
+        with FakeLLMServer(latency=0, requests_per_minute=600, burst=5) as llm:
+            client = limited_client(llm)
+
+            async def background():
+                while True:
+                    await complete(client, BACKGROUND)
+
+            workers = [asyncio.create_task(background()) for _ in range(30)]
+            while not llm.rejections:
+                await asyncio.sleep(0.01)
+            timings = []
+            for _ in range(3):
+                t0 = time.perf_counter()
+                await complete(client, INTERACTIVE)
+                timings.append(time.perf_counter() - t0)
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await client.close()
+            return timings
+
+    timings = asyncio.run(run())
+    # The server admits one request per 0.1 s; an interactive one gets one of
+    # the next few slots, not a turn after the background backlog.
+    assert max(timings) < 1.0
+
+
+def test_retry_waits_for_retry_after():
+    async def run():
+        with FakeLLMServer(latency=0, requests_per_minute=60, burst=1) as llm:
+            client = limited_client(llm)
+            await complete(client, INTERACTIVE)
+            await complete(client, INTERACTIVE)
+            await client.close()
+            return llm.rejections, llm.accepted
+
+    rejections, accepted = asyncio.run(run())
+    [(rejected_at, retry_after)] = rejections
+    assert retry_after > 0.5
+    assert accepted[-1] - rejected_at >= retry_after
+
+
+def test_rate_limit_error_after_max_retries():
+    async def run():
+        # burst=0: every request is rejected with a Retry-After of 10 ms.
+        with FakeLLMServer(latency=0, requests_per_minute=6000, burst=0) as llm:
+            client = limited_client(llm, max_retries=3)
+            with pytest.raises(openai.RateLimitError):
+                await complete(client, INTERACTIVE)
+            await client.close()
+            return llm.rejections
+
+    rejections = asyncio.run(run())
+    assert len(rejections) == 4
+    # Each retry waited for the Retry-After of the rejection before it.
+    for (previous, retry_after), (rejected_at, _) in zip(rejections, rejections[1:]):
+        assert rejected_at - previous >= retry_after
+
+
+def test_parse_model_limits():
+    limits = parse_model_limits("whisper-large-v3-turbo=20:0, meta-llama/llama-4-scout-17b-16e-instruct=30:30000,other=:500,")
+    assert limits == {
+        "whisper-large-v3-turbo": ModelLimits(20, None),
+        "meta-llama/llama-4-scout-17b-16e-instruct": ModelLimits(30, 30000),
+        "other": ModelLimits(None, 500),
+    }
+    assert parse_model_limits("") == {}
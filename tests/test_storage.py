@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+from src.my_agent.archive import Compactor, MessageArchive
+from src.my_agent.storage import AUTO_VACUUM_INCREMENTAL, Storage
+
+LOCK_SECONDS = 0.3
+
+
+def test_write_lock_wait_does_not_block_the_loop(tmp_path):
+    db_path = str(tmp_path / "chat_history.db")
+    storage = Storage(db_path, max_pending_writes=1)
+    locked = threading.Event()
+
+    def hold_write_lock():
+        # Another process writing, e.g. a second sharded worker.
+        conn = sqlite3.connect(db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(LOCK_SECONDS)
+        conn.commit()
+        conn.close()
+
+    async def run():
+        ticks = 0
+        done = False
+
+        async def tick():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        thread = threading.Thread(target=hold_write_lock)
+        thread.start()
+        locked.wait()
+        await storage.awrite("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", ("1", "user", "hello"))
+        done = True
+        await ticker
+        thread.join()
+        return ticks
+
+    ticks = asyncio.run(run())
+    # Committed at once, so other connections see the row.
+    other = sqlite3.connect(db_path)
+    assert other.execute("SELECT content FROM messages").fetchall() == [("hello",)]
+    other.close()
+    storage.close()
+    assert ticks >= LOCK_SECONDS / 0.01 / 2
+
+
+def test_write_waits_for_transaction_waiting_for_the_lock(tmp_path):
+    db_path = str(tmp_path / "chat_history.db")
+    storage = Storage(db_path, max_pending_writes=1)
+    locked = threading.Event()
+
+    def hold_write_lock():
+        conn = sqlite3.connect(db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(LOCK_SECONDS)
+        conn.commit()
+        conn.close()
+
+    async def run():
+        order = []
+
+        async def compact():
+            async with storage.transaction() as conn:
+                conn.execute("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", ("1", "user", "compacted"))
+                order.append("transaction")
+
+        async def write():
+            await storage.awrite("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", ("1", "user", "hello"))
+            order.append("write")
+
+        thread = threading.Thread(target=hold_write_lock)
+        thread.start()
+        locked.wait()
+        # The transaction backs off first; the write must not slip in between
+        # its attempts and leave BEGIN IMMEDIATE inside a transaction.
+        transaction = asyncio.create_task(compact())
+        await asyncio.sleep(0.05)
+        await asyncio.gather(transaction, write())
+        thread.join()
+        return order
+
+    order = asyncio.run(run())
+    rows = storage.execute("SELECT content FROM messages ORDER BY id").fetchall()
+    storage.close()
+    assert order == ["transaction", "write"]
+    assert rows == [("compacted",), ("hello",)]
+
+
+def test_new_database_needs_no_vacuum_rebuild(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    storage = Storage(str(tmp_path / "chat_history.db"))
+    mode = storage.execute("PRAGMA auto_vacuum").fetchone()[0]
+    storage.close()
+    assert mode == AUTO_VACUUM_INCREMENTAL
+    assert "rebuilding" not in caplog.text
+
+
+def test_existing_database_is_rebuilt_by_the_first_compaction(tmp_path):
+    db_path = str(tmp_path / "chat_history.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT)")
+    conn.commit()
+    conn.close()
+    # Opening the database, in every worker, leaves it as it is.
+    storage = Storage(db_path)
+    mode_at_start = storage.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    other_shard = Compactor(MessageArchive(storage), shard=(1, 2))
+    asyncio.run(other_shard.run_once())
+    mode_after_other_shard = storage.execute("PRAGMA auto_vacuum").fetchone()[0]
+    first_shard = Compactor(MessageArchive(storage), shard=(0, 2))
+    asyncio.run(first_shard.run_once())
+    mode = storage.execute("PRAGMA auto_vacuum").fetchone()[0]
+    storage.close()
+    assert mode_at_start == mode_after_other_shard == 0
+    assert mode == AUTO_VACUUM_INCREMENTAL
+
+
+def test_sharded_compaction_only_moves_own_sessions(tmp_path):
+    storage = Storage(str(tmp_path / "chat_history.db"))
+    for session_id in ("10", "11"):
+        for i in range(12):
+            storage.write("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, "user", f"m{i}"))
+        storage.write("""
+            INSERT INTO summaries (session_id, level, start_msg_id, end_msg_id, summary_text)
+            SELECT ?, 0, MIN(id), MAX(id), 'summary' FROM messages WHERE session_id = ?
+        """, (session_id, session_id))
+    archive = MessageArchive(storage)
+
+    moved = asyncio.run(archive.compact(hot_messages=2, chunk_messages=5, shard=(1, 2)))
+    archived = [session_id for session_id, in storage.execute("SELECT DISTINCT session_id FROM message_archive")]
+    storage.close()
+    assert moved == 10
+    assert archived == ["11"]
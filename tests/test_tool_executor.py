@@ -0,0 +1,37 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from src.my_agent.tools.tool_executor import ToolExecutor
+from src.my_agent.tools.web_search_tool import WebSearchTool
+
+
+class SlowTavilyClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.cancelled = 0
+
+    async def search(self, question):
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"query": question, "results": []}
+
+
+def tool_call(question: str):
+    return SimpleNamespace(id="call_0", function=SimpleNamespace(name="web_search", arguments=json.dumps({"question": question})))
+
+
+def test_timed_out_search_is_cancelled():
+    client = SlowTavilyClient(latency=5)
+    executor = ToolExecutor({"web_search": WebSearchTool(client)}, timeout=0.1)
+
+    t0 = time.perf_counter()
+    [result] = asyncio.run(executor.run([tool_call("weather today")]))
+
+    assert time.perf_counter() - t0 < 1
+    assert "timed out" in json.loads(result["content"])["error"]
+    assert client.cancelled == 1
@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeBot, FakeFileServer, FakeLLMServer, voice_update
+from src.my_agent.audio import AudioPipeline
+from src.my_agent.llm_client import create_http_client, create_llm_client
+from src.my_agent.my_agent import BASE_CONTEXT, MODEL, TRANSCRIPTION_MODEL, create_transcription_function, create_turn_function
+from src.my_agent.session_registry import ChatContextRegistry
+from src.my_agent.turn_scheduler import TurnScheduler
+
+
+async def summarize(messages):
+    return "summary"
+
+
+def test_transcript_is_stored_once(tmp_path):
+    async def run():
+        with FakeLLMServer(latency=0, time_to_first_token=0) as llm, FakeFileServer(latency=0) as files:
+            client = create_llm_client(api_key="fake", base_url=f"{llm.url}/openai/v1", max_retries=0)
+            download_client = create_http_client()
+            contexts = ChatContextRegistry(str(tmp_path / "chat_history.db"), summarize_fn=summarize)
+            turns = TurnScheduler(create_turn_function(client, MODEL, BASE_CONTEXT, contexts, {}), debounce=0)
+            transcription = create_transcription_function(client, TRANSCRIPTION_MODEL, contexts, {}, AudioPipeline(download_client), turns=turns)
+
+            await transcription(voice_update(1, "voice_1"), SimpleNamespace(bot=FakeBot(files.url, latency=0)))
+            roles = [role for role, in contexts.storage.execute("SELECT role FROM messages ORDER BY id").fetchall()]
+
+            await turns.close()
+            await contexts.close()
+            await download_client.aclose()
+            await client.close()
+            return roles
+
+    assert asyncio.run(run()) == ["user", "assistant"]
+
+
+def test_exclusive_waits_for_the_running_turn():
+    events = []
+
+    async def run_turn(text, update, context, turn):
+        events.append(f"input {text}")
+        await asyncio.sleep(0.05)
+        events.append(f"reply {text}")
+
+    async def run():
+        turns = TurnScheduler(run_turn, debounce=0)
+        submitted = asyncio.create_task(turns.submit("1", "hello", None, None))
+        await asyncio.sleep(0.01)
+        async with turns.exclusive("1"):
+            events.append("photo")
+        await submitted
+        await turns.close()
+        return turns
+
+    turns = asyncio.run(run())
+    assert events == ["input hello", "reply hello", "photo"]
+    assert not turns._locks